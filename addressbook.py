@@ -0,0 +1,1632 @@
+from bisect import bisect_left, bisect_right, insort
+import calendar
+from collections import Counter, OrderedDict, UserDict, defaultdict, deque, namedtuple
+from collections.abc import Mapping, MutableMapping
+from contextlib import contextmanager, nullcontext
+import csv
+import gc
+import heapq
+from datetime import date, datetime, timedelta
+import io
+from itertools import count, groupby, islice
+import json
+import lzma
+import math
+import mmap
+import os
+import pickle
+import re
+import struct
+import sys
+import threading
+import time
+import zlib
+from functools import lru_cache
+
+from instrumentation import METRICS
+
+VALIDATORS = {}  # field kind -> function returning the canonical form of a value, raises ValueError
+
+
+def validator(kind, cache_size=1 << 16):
+    # Registers the check for a kind of field; the same values come back again and again in imports,
+    # so every check keeps an LRU cache of its results (errors are not cached)
+    def register(function):
+        VALIDATORS[kind] = lru_cache(maxsize=cache_size)(function)
+        return VALIDATORS[kind]
+    return register
+
+
+def validate(kind, value):
+    return VALIDATORS[kind](value)
+
+
+def validate_many(kind, values):
+    # {value: canonical value or the ValueError} with every distinct value checked once
+    check = VALIDATORS[kind]
+    results = {}
+    for value in values:
+        if value not in results:
+            try:
+                results[value] = check(value)
+            except ValueError as error:
+                results[value] = error
+    return results
+
+
+PHONE_SEPARATORS = re.compile(r"[\s().\-/]+")
+NATIONAL_PHONE = re.compile(r"\d{10}")
+INTERNATIONAL_PHONE = re.compile(r"(?:\+|00)(\d{8,15})")
+NON_DIGITS = re.compile(r"\D+")
+
+
+@validator('phone')
+def canonical_phone(phone):
+    # "012-345 67 89" -> "0123456789", "+48 (12) 345 67 89" -> "+48123456789"
+    compact = PHONE_SEPARATORS.sub('', str(phone))
+    if NATIONAL_PHONE.fullmatch(compact):
+        return compact
+    match = INTERNATIONAL_PHONE.fullmatch(compact)
+    if match:
+        return '+' + match.group(1)
+    raise ValueError("Invalid phone number: must be 10 digits or start with + and the country code")
+
+
+EMAIL_LOCAL_PART = re.compile(r"[\w!#$%&'*+/=?^`{|}~-]+(?:\.[\w!#$%&'*+/=?^`{|}~-]+)*")
+EMAIL_DOMAIN = re.compile(r"(?:[a-z0-9](?:[a-z0-9-]{0,61}[a-z0-9])?\.)+(?:[a-z]{2,63}|xn--[a-z0-9-]{1,59})")
+
+
+@validator('email')
+def canonical_email(email):
+    # Lower-cased, with an internationalised domain checked in its ASCII (punycode) form
+    local, at, domain = str(email).strip().rpartition('@')
+    if not at or not EMAIL_LOCAL_PART.fullmatch(local):
+        raise ValueError("Invalid email address")
+    try:
+        ascii_domain = domain.encode('idna').decode('ascii').lower()
+    except UnicodeError:
+        raise ValueError("Invalid email address") from None
+    if not EMAIL_DOMAIN.fullmatch(ascii_domain):
+        raise ValueError("Invalid email address")
+    return f"{local.lower()}@{ascii_domain.encode('ascii').decode('idna')}"
+
+
+BIRTHDAY_PATTERN = re.compile(r"(\d{2})\.(\d{2})\.(\d{4})")
+OLDEST_AGE = 130
+
+
+@validator('birthday')
+def birthday_ordinal(birthday):
+    # DD.MM.YYYY -> ordinal day, for a date that exists and gives a possible age
+    match = BIRTHDAY_PATTERN.fullmatch(str(birthday).strip())
+    if not match:
+        raise ValueError("Invalidd birthday format. DD.MM.YYYY required")
+    day, month, year = map(int, match.groups())
+    try:
+        born = date(year, month, day)
+    except ValueError:
+        raise ValueError(f"Invalid birthday: {birthday} is not a date") from None
+    today = date.today()
+    if born > today:
+        raise ValueError("Invalid birthday: the date is in the future")
+    if today.year - born.year > OLDEST_AGE:
+        raise ValueError(f"Invalid birthday: nobody is older than {OLDEST_AGE}")
+    return born.toordinal()
+
+class Field:
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __str__(self):
+        return str(self.value)
+
+    def __getstate__(self):
+        return (self.value,)
+
+    def __setstate__(self, state):
+        if isinstance(state, dict):  # pickled before the fields got __slots__
+            state = (state['value'],)
+        self.value, = state
+
+class Name(Field):
+    __slots__ = ()
+
+    def __init__(self, value):
+        if value:  
+            self.value = value
+        else:
+            raise ValueError("Name field is required")
+
+class Phone(Field):
+    __slots__ = ()
+    _packed = Field.value  # the inherited slot holds 10 digit numbers as an int
+
+    def __init__(self, value):
+        self.value = validate('phone', value)
+
+    @property
+    def value(self):
+        packed = self._packed
+        return f"{packed:010d}" if isinstance(packed, int) else packed
+
+    @value.setter
+    def value(self, phone):
+        phone = str(phone)
+        self._packed = int(phone) if len(phone) == 10 and phone.isdigit() else phone
+
+    def __getstate__(self):
+        return (self._packed,)
+
+    def __setstate__(self, state):
+        if isinstance(state, dict):
+            self.value = state['value']
+        else:
+            self._packed, = state
+    
+    def validate_phone(self, phone):
+        try:
+            validate('phone', phone)
+        except ValueError:
+            return False
+        return True
+    
+class Email(Field):
+    __slots__ = ()
+
+    def __init__(self, value):
+        self.value = validate('email', value)
+    
+    def validate_email(self, email):
+        try:
+            validate('email', email)
+        except ValueError:
+            return False
+        return True
+    
+class Address(Field):
+    __slots__ = ()
+
+    def __init__(self, value):
+        self.value = value
+
+class Notes(Field):
+    __slots__ = ()
+
+    def __init__(self, value):
+        self.value = value
+
+class Birthday(Field):
+    __slots__ = ()
+    _ordinal = Field.value  # the inherited slot holds the date as an ordinal day
+
+    def __init__(self, value):
+        self._ordinal = validate('birthday', value)
+
+    @property
+    def value(self):
+        day = datetime.fromordinal(self._ordinal)
+        return f"{day.day:02d}.{day.month:02d}.{day.year:04d}"
+
+    @value.setter
+    def value(self, birthday):
+        self._ordinal = datetime.strptime(birthday, "%d.%m.%Y").toordinal()
+
+    @property
+    def date(self):
+        return date.fromordinal(self._ordinal)
+
+    def __getstate__(self):
+        return (self._ordinal,)
+
+    def __setstate__(self, state):
+        if isinstance(state, dict):
+            self.value = state['value']
+        else:
+            self._ordinal, = state
+
+def intern_tags(tags):
+    # Tags repeat across thousands of notes, so every note shares one string per tag
+    return tuple(sys.intern(tag) for tag in tags)
+
+def normalise_phone(phone):
+    return NON_DIGITS.sub('', str(phone))
+
+# Each record index maps a key to {member: value}; these yield the (key, member, value) entries of one record
+def tag_entries(record):
+    name = record.name.value
+    for note, tags in record.notes.items():
+        for tag in tags:
+            yield tag.casefold(), (name, note), None
+
+def birthday_entries(record):
+    if record.birthday:
+        birthday = record.birthday.date
+        yield (birthday.month, birthday.day), record.name.value, birthday.toordinal()
+
+def phone_entries(record):
+    for phone in record.phones:
+        yield normalise_phone(phone.value), record.name.value, None
+
+def email_entries(record):
+    for email in record.emails:
+        yield email.value.casefold(), record.name.value, None
+
+WORD_PATTERN = re.compile(r"\w+")
+
+def tokenize(text):
+    return WORD_PATTERN.findall(text.casefold())
+
+def note_word_entries(record):
+    name = record.name.value
+    for note in record.notes:
+        for word, frequency in Counter(tokenize(note)).items():
+            yield word, (name, note), frequency
+
+NO_BOOK = nullcontext()
+
+
+class Record:
+    __slots__ = ('name', 'phones', 'emails', 'addresses', 'notes', 'birthday', '_book')
+
+    def __init__(self, name):
+        self.name = Name(name)
+        self.phones = []
+        self.emails = []
+        self.addresses = []
+        self.notes = {} #Create dictionary to make notes and his tags.
+        self.birthday = None
+        self._book = None  # AddressBook the record is stored in, kept out of pickles
+
+    def __getstate__(self):
+        return (self.name, self.phones, self.emails, self.addresses, self.notes, self.birthday)
+
+    def __setstate__(self, state):
+        if isinstance(state, dict):  # pickled before Record got __slots__
+            state = (state['name'], state['phones'], state['emails'], state['addresses'],
+                     state['notes'], state['birthday'])
+        self.name, self.phones, self.emails, self.addresses, notes, self.birthday = state
+        self.notes = {note: intern_tags(tags) for note, tags in notes.items()}
+        self._book = None
+
+    def _changing(self):
+        # Records that are not in a book yet (e.g. while an import builds them) have nobody to tell
+        return NO_BOOK if self._book is None else self._book_change()
+
+    @contextmanager
+    def _book_change(self):
+        # Let the owning book drop the old index entries, then reindex and journal the new state
+        book = self._book
+        with book._change_lock:
+            book._record_will_change(self)
+            try:
+                yield
+            finally:
+                book._record_changed(self)
+
+    def add_notes(self, note, tags):
+        tags = intern_tags(tags)
+        with self._changing():
+            self.notes[note] = tags
+
+    def add_birthday(self, birthday):
+        birthday = Birthday(birthday)
+        with self._changing():
+            self.birthday = birthday
+
+    def add_phone(self, phone):
+        phone = Phone(phone)
+        with self._changing():
+            self.phones.append(phone)
+        
+    def add_email(self, email):
+        email = Email(email)
+        with self._changing():
+            self.emails.append(email)
+        
+    def add_address(self, address):
+        address = Address(address)
+        with self._changing():
+            self.addresses.append(address)
+
+    @staticmethod
+    def _phone_key(phone):
+        # Numbers are compared by their canonical digits, so "012 345 6789" finds "0123456789"
+        try:
+            phone = validate('phone', phone)
+        except ValueError:
+            pass
+        return normalise_phone(phone)
+
+    @staticmethod
+    def _email_key(email):
+        # Addresses are compared in their stored canonical form, so "ann@xn--mnchen-3ya.de" finds "ann@münchen.de"
+        try:
+            email = validate('email', email)
+        except ValueError:
+            pass
+        return str(email).strip().casefold()
+
+    def edit_phone(self, old_phone, new_phone):
+        new_phone = validate('phone', new_phone)
+        old_key = self._phone_key(old_phone)
+        with self._changing():
+            for phone in self.phones:
+                if self._phone_key(phone.value) == old_key:
+                    phone.value = new_phone
+
+    def find_phone(self, phone_number):
+        key = self._phone_key(phone_number)
+        for phone in self.phones:
+            if self._phone_key(phone.value) == key:
+                return phone
+        return None
+    
+    def remove_phone(self, phone_number):
+        key = self._phone_key(phone_number)
+        with self._changing():
+            for phone in self.phones:
+                if self._phone_key(phone.value) == key:
+                    self.phones.remove(phone)
+
+    def edit_notes(self, old_note, new_note, new_tags=None):
+        if old_note in self.notes:
+            with self._changing():
+                self.notes[new_note] = intern_tags(new_tags) if new_tags is not None else self.notes[old_note]
+                if old_note != new_note:
+                    del self.notes[old_note]
+            print(f"Note edited successfully: {new_note}. Tags: {', '.join(new_tags if new_tags else [])}")
+        else:
+            print(f"Note '{old_note}' not found.")
+
+    def delete_notes(self, note):
+        if note in self.notes:
+            with self._changing():
+                del self.notes[note]
+            print(f"Note '{note}' deleted successfully.")
+        else:
+            print(f"Note '{note}' not found.")
+
+    def __str__(self):
+        phone_info = '; '.join(str(p) for p in self.phones)
+        email_info = '; '.join(str(e) for e in self.emails)
+        address_info = '; '.join(str(a) for a in self.addresses)
+        note_info = ''.join(f"{note}. TAGI: {', '.join(tags)}\n" for note, tags in self.notes.items())
+        birthday_info = f"Birthday: {self.birthday.value}" if self.birthday else "No birthday set"
+        return f"--------------------\nContact name: {self.name.value}, phones: {phone_info}, emails: {email_info}, address: {address_info}, {birthday_info}\nNotes:\n{note_info}"
+
+
+def group_shared_values(indexes):
+    # Union-find over contacts that share a value in any of the {value: names} indexes,
+    # returns [(names, shared values)]
+    parent = {}
+
+    def root(name):
+        parent.setdefault(name, name)
+        while parent[name] != name:
+            parent[name] = parent[parent[name]]
+            name = parent[name]
+        return name
+
+    shared = []
+    for index in indexes:
+        for value, names in index.items():
+            if len(names) > 1:
+                first, *others = names
+                for other in others:
+                    parent[root(other)] = root(first)
+                shared.append((first, value))
+    groups = defaultdict(lambda: ([], []))
+    for name in parent:
+        groups[root(name)][0].append(name)
+    for name, value in shared:
+        groups[root(name)][1].append(value)
+    return [(names, values) for names, values in groups.values()]
+
+
+UpcomingBirthday = namedtuple('UpcomingBirthday', 'name birthday date days age')
+
+
+def birthday_horizon(today, days):
+    # How many days ahead are searched: at most up to the same date next year, so nobody comes up twice.
+    # From 29 February that date is 1 March, the 28th of the next year is still a day to search
+    try:
+        same_day_next_year = today.replace(year=today.year + 1)
+    except ValueError:
+        same_day_next_year = date(today.year + 1, 3, 1)
+    return min(days, (same_day_next_year - today).days)
+
+
+def birthday_calendar(today, days):
+    # (offset, day, (month, day) keys of the birthdays celebrated that day) for every day of the horizon
+    leap_day_today = today.month == 2 and today.day == 29
+    for offset in range(birthday_horizon(today, days)):
+        day = today + timedelta(days=offset)
+        keys = [(day.month, day.day)]
+        if day.month == 2 and day.day == 28 and not calendar.isleap(day.year) and not leap_day_today:
+            keys.append((2, 29))  # 29 February birthdays are celebrated on the 28th in other years
+        yield offset, day, keys
+
+Change = namedtuple('Change', 'time name before after')  # pickled records, None where the contact did not exist
+Step = namedtuple('Step', 'label time changes')  # the changes one command made, undone and redone together
+
+
+class BookUnpickler(pickle.Unpickler):
+    # Books saved before the classes moved here refer to __main__.Record (written by "python main.py") or
+    # main.Record (written by the server); both names resolve to this module
+    def find_class(self, module, name):
+        if module in ('__main__', 'main'):
+            module = __name__
+        return super().find_class(module, name)
+
+
+def unpickle(file):
+    return BookUnpickler(file).load()
+
+
+def pickled(record):
+    return None if record is None else pickle.dumps(record, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+class History:
+    # Undo/redo steps plus a timeline of every change for as_of views. Only the records that changed are
+    # kept (pickled before and after), so the memory grows with the number of changes, not the book size.
+    def __init__(self, limit=1000, timeline_limit=100000, step_limit=10000):
+        self.since = time.time()  # the book is known from here on
+        self.undo_steps = deque(maxlen=limit)
+        self.redo_steps = []
+        self.timeline = deque()
+        self.timeline_limit = timeline_limit
+        self.step_limit = step_limit  # a command changing more contacts (a big import) cannot be undone
+        self.replaying = False  # undo/redo at work: their changes go on the timeline but are not new steps
+        self._before = {}  # contact name -> pickled record while a Record method changes it
+        self._step = None
+        self._step_oversized = False
+
+    def record(self, name, before, after):
+        change = Change(time.time(), name, before, after)
+        self.timeline.append(change)
+        if len(self.timeline) > self.timeline_limit:
+            self.since = self.timeline.popleft().time
+        if self.replaying:
+            return
+        self.redo_steps.clear()
+        if self._step is None:
+            self.undo_steps.append(Step(None, change.time, [change]))
+        elif self._step_oversized:
+            return
+        elif len(self._step.changes) < self.step_limit:
+            self._step.changes.append(change)
+        else:
+            self._step.changes.clear()  # the pickled states of an oversized step are dropped right away
+            self._step_oversized = True
+
+    @contextmanager
+    def step(self, label):
+        if self._step is not None:  # a command run by another command belongs to the outer step
+            yield
+            return
+        self._step = Step(label, time.time(), [])
+        self._step_oversized = False
+        try:
+            yield
+        finally:
+            step, self._step = self._step, None
+            if self._step_oversized:
+                # The earlier steps would be undone on top of changes that were not kept, so they go as well
+                self.undo_steps.clear()
+            elif step.changes:
+                self.undo_steps.append(step)
+
+def record_footprint(record):
+    # Bytes held by a record and every object it references, except the book itself
+    seen = set()
+    pending = [record]
+    total = 0
+    while pending:
+        obj = pending.pop()
+        if obj is None or id(obj) in seen or isinstance(obj, AddressBook):
+            continue
+        seen.add(id(obj))
+        total += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            pending.extend(obj.keys())
+            pending.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set)):
+            pending.extend(obj)
+        elif not isinstance(obj, (str, bytes, int, float)):
+            if hasattr(obj, '__dict__'):
+                pending.append(obj.__dict__)
+            for cls in type(obj).__mro__:
+                for slot in cls.__dict__.get('__slots__', ()):
+                    descriptor = cls.__dict__[slot]
+                    try:
+                        pending.append(descriptor.__get__(obj, cls))
+                    except AttributeError:
+                        pass
+    return total
+
+
+class AddressBook(UserDict):
+    _record_indexes = {
+        '_tags': tag_entries,  # casefolded tag -> {(contact name, note): None}
+        '_birthdays': birthday_entries,  # (month, day) -> {contact name: birthday as ordinal day}
+        '_phones': phone_entries,  # phone digits -> {contact name: None}
+        '_emails': email_entries,  # casefolded email -> {contact name: None}
+        '_note_words': note_word_entries,  # word of a note -> {(contact name, note): times it occurs}
+    }
+    _sorted_record_indexes = ('_note_words',)  # indexes that also keep their keys sorted for prefix queries
+    _cached_indexes = tuple(_record_indexes) + ('_sorted_keys', '_folded_names', '_name_grams', '_name_order')
+
+    def __init__(self, *args, **kwargs):
+        for attribute in self._record_indexes:
+            setattr(self, attribute, defaultdict(dict))
+        self._sorted_keys = {attribute: [] for attribute in self._sorted_record_indexes}
+        self._folded_names = {}  # contact name -> casefolded name
+        self._name_grams = defaultdict(set)  # trigram of a casefolded name -> contact names
+        self._name_order = {}  # contact name -> insertion number, keeps search results in book order
+        self._order_counter = count()
+        self._listing = None  # sorted [(casefolded name, name)] for paged listings, built on first use
+        self._listing_added = []  # names added since the listing was sorted
+        self._listing_stale = False  # names were deleted since the listing was sorted
+        self._rendered = OrderedDict()  # contact name -> str(record), least recently shown first
+        self._rendered_limit = 10000
+        self._rendered_lock = threading.Lock()  # readers may render from several server threads
+        self._journal = None  # open append-only log file while journaling is on
+        self._journal_path = None
+        self._journal_lock = threading.Lock()
+        self._journal_entries = 0
+        self._compact_every = 0
+        self._compaction = None
+        self._snapshot_path = None
+        self._compression = 'zlib'
+        self._snapshot_views = []  # SnapshotViews of snapshots being written right now
+        self._change_lock = threading.RLock()  # held by every change, so a snapshot starts before or after it
+        self.last_snapshot = None  # SnapshotStats of the latest snapshot written by compact()
+        self._version = 0  # counts changes, lets derived data such as the birthday columns be reused
+        self._birthday_columns = None  # (version, analytics.BirthdayColumns) built by the birthday reports
+        self._history = None  # History once enable_history() is called
+        super().__init__(*args, **kwargs)
+
+    def __setitem__(self, name, record):
+        with self._change_lock:
+            old_record = self.data.get(name)
+            if self._history is not None:
+                self._history.record(name, pickled(old_record), pickled(record))
+            if old_record is not None:
+                self._detach(old_record)
+            else:
+                self._index_name(name)
+            self.data[name] = record
+            self._attach(record)
+            self._version += 1
+            self._log('put', name, record)
+
+    def __delitem__(self, name):
+        with self._change_lock:
+            record = self.data.pop(name)
+            if self._history is not None:
+                self._history.record(name, pickled(record), None)
+            self._detach(record)
+            self._unindex_name(name)
+            self._version += 1
+            self._log('del', name)
+
+    @staticmethod
+    def _trigrams(text):
+        return {text[i:i + 3] for i in range(len(text) - 2)}
+
+    def _index_name(self, name):
+        folded = name.casefold()
+        self._folded_names[name] = folded
+        if self._listing is not None:
+            self._listing_added.append((folded, name))
+        self._name_order[name] = next(self._order_counter)
+        for gram in self._trigrams(folded):
+            self._name_grams[gram].add(name)
+
+    def _unindex_name(self, name):
+        folded = self._folded_names.pop(name)
+        del self._name_order[name]
+        self._listing_stale = True
+        for gram in self._trigrams(folded):
+            names = self._name_grams[gram]
+            names.discard(name)
+            if not names:
+                del self._name_grams[gram]
+
+    def _attach(self, record):
+        record._book = self
+        self._index_record(record)
+
+    def _detach(self, record):
+        self._unindex_record(record)
+        self._rendered.pop(record.name.value, None)
+        record._book = None
+
+    def _record_will_change(self, record):
+        if self._history is not None:
+            self._history._before[record.name.value] = pickled(record)
+        for view in self._snapshot_views:
+            view.preserve(record.name.value)
+        self._unindex_record(record)
+        self._rendered.pop(record.name.value, None)
+
+    def _record_changed(self, record):
+        self._index_record(record)
+        self._version += 1
+        if self._history is not None:
+            name = record.name.value
+            self._history.record(name, self._history._before.pop(name), pickled(record))
+        self._log('put', record.name.value, record)
+
+    def _index_record(self, record):
+        for attribute, entries in self._record_indexes.items():
+            index = getattr(self, attribute)
+            if index is not None:
+                sorted_keys = self._sorted_keys.get(attribute)
+                for key, member, value in entries(record):
+                    if sorted_keys is not None and key not in index:
+                        insort(sorted_keys, key)
+                    index[key][member] = value
+
+    def _unindex_record(self, record):
+        for attribute, entries in self._record_indexes.items():
+            index = getattr(self, attribute)
+            if index is not None:
+                sorted_keys = self._sorted_keys.get(attribute)
+                for key, member, _ in entries(record):
+                    members = index.get(key)
+                    if members is not None:
+                        members.pop(member, None)
+                        if not members:
+                            del index[key]
+                            if sorted_keys is not None:
+                                del sorted_keys[bisect_left(sorted_keys, key)]
+
+    def _record_index(self, attribute):
+        # Mapped books only decode every record for an index once somebody queries it
+        index = getattr(self, attribute)
+        if index is None:
+            index = defaultdict(dict)
+            entries = self._record_indexes[attribute]
+            for record in self.iter_records():
+                for key, member, value in entries(record):
+                    index[key][member] = value
+            setattr(self, attribute, index)
+            if attribute in self._sorted_record_indexes:
+                self._sorted_keys[attribute] = sorted(index)
+        return index
+
+    def index_state(self):
+        # The derived indexes, saved next to the snapshot so the next start does not have to rebuild them
+        state = {attribute: getattr(self, attribute) for attribute in self._cached_indexes}
+        state['_order_counter'] = next(self._order_counter)
+        return state
+
+    @classmethod
+    def from_index_state(cls, data, state):
+        # Takes over indexes that were built for exactly these records instead of indexing them one by one
+        book = cls()
+        for attribute in cls._cached_indexes:
+            setattr(book, attribute, state[attribute])
+        book._order_counter = count(state['_order_counter'])
+        for record in data.values():
+            record._book = book
+        book.data = data
+        return book
+
+    def add_record(self, record):
+        self[record.name.value] = record
+
+    def add_records(self, records):
+        # The other backends store a whole batch at once, import_contacts goes through this for all of them
+        for record in records:
+            self[record.name.value] = record
+        return len(records)
+    
+    def find(self, name):
+        return self.data.get(name)
+
+    def _matching_names(self, name):
+        query = name.casefold()
+        grams = self._trigrams(query)
+        if not grams:
+            # Queries shorter than a trigram only scan the folded names, never the records
+            for contact_name, folded in self._folded_names.items():
+                if query in folded:
+                    yield contact_name
+            return
+        postings = sorted((self._name_grams.get(gram, set()) for gram in grams), key=len)
+        candidates = postings[0].intersection(*postings[1:])
+        matches = [n for n in candidates if query in self._folded_names[n]]
+        matches.sort(key=self._name_order.__getitem__)
+        yield from matches
+
+    def iter_findname(self, name, offset=0, limit=None):
+        stop = None if limit is None else offset + limit
+        for contact_name in islice(self._matching_names(name), offset, stop):
+            yield self.data[contact_name]
+
+    def findname(self, name):
+        found_contacts = list(self.iter_findname(name))
+        return found_contacts if found_contacts else None
+
+    def iter_records(self):
+        # Records of a mapped book are decoded one at a time and not kept in memory
+        if isinstance(self.data, MappedRecords):
+            for name in self.data:
+                yield self.data.peek(name)
+        else:
+            yield from self.data.values()
+
+    def _sorted_listing(self):
+        # New names are merged into the sorted listing and deleted ones dropped, instead of resorting
+        if self._listing is None:
+            self._listing = sorted((folded, name) for name, folded in self._folded_names.items())
+        elif self._listing_added or self._listing_stale:
+            merged = heapq.merge(self._listing, sorted(self._listing_added))
+            self._listing = [entry for entry, _ in groupby(merged) if self._folded_names.get(entry[1]) == entry[0]]
+        self._listing_added = []
+        self._listing_stale = False
+        return self._listing
+
+    def iter_sorted_records(self, offset=0, limit=None, after=None):
+        # Records in casefolded name order; 'after' is the name the previous page ended with
+        listing = self._sorted_listing()
+        start = offset + (bisect_right(listing, (after.casefold(), after)) if after is not None else 0)
+        stop = len(listing) if limit is None else min(len(listing), start + limit)
+        peek = self.data.peek if isinstance(self.data, MappedRecords) else self.data.__getitem__
+        for position in range(start, stop):
+            yield peek(listing[position][1])
+
+    def render(self, record):
+        name = record.name.value
+        with self._rendered_lock:
+            text = self._rendered.get(name)
+            if text is not None:
+                self._rendered.move_to_end(name)
+                return text
+        text = str(record)
+        with self._rendered_lock:
+            self._rendered[name] = text
+            if len(self._rendered) > self._rendered_limit:
+                self._rendered.popitem(last=False)
+        return text
+
+    def remove_phone(self, name):
+        if name in self.data:
+            del self[name]
+            print(f"Contact {name} deleted.")
+        else:
+            print("Contact not found.")
+
+    def save_to_file(self, filename, compression=None):
+        if isinstance(self.data, MappedRecords):
+            self.data.save(filename)
+            return None
+        view = self._open_snapshot()
+        try:
+            return write_snapshot(filename, view, compression or self._compression)
+        finally:
+            with self._change_lock:
+                self._snapshot_views.remove(view)
+
+    def _open_snapshot(self):
+        # Changes made while the snapshot is written do not show up in it, see SnapshotView
+        with self._change_lock:
+            view = SnapshotView(self.data)
+            self._snapshot_views.append(view)
+        return view
+
+    def open_journal(self, snapshot_path, compact_every=1000, compression='zlib'):
+        # Every change is appended to <snapshot>.journal, the snapshot itself is only rewritten by compact()
+        self._snapshot_path = snapshot_path
+        self._journal_path = snapshot_path + '.journal'
+        self._compact_every = compact_every
+        self._compression = compression
+        self._journal = open(self._journal_path, 'ab')
+
+    def _log(self, op, name, record=None):
+        if self._journal is None:
+            return
+        entry = (op, name) if record is None else (op, name, record)
+        with self._journal_lock:
+            pickle.dump(entry, self._journal, protocol=pickle.HIGHEST_PROTOCOL)
+            self._journal.flush()
+            self._journal_entries += 1
+            # Folding costs O(book), so wait for at least as many entries as there are contacts
+            start_compaction = (self._compact_every and self._compaction is None
+                                and self._journal_entries >= max(self._compact_every, len(self.data)))
+            if start_compaction:
+                self._compaction = threading.Thread(target=self._compact, daemon=True)
+        if start_compaction:
+            self._compaction.start()
+
+    def import_contacts(self, filename, batch_size=1000, workers=0, rejected_filename=None):
+        # Streams CSV/JSONL rows, validates them batch by batch and reports rejected rows in a CSV file.
+        # The format is checked and the file opened first, the report is only created once a row is rejected
+        file_format = contact_file_format(filename)
+        rejected_filename = rejected_filename or filename + '.rejected.csv'
+        imported = rejected = 0
+        report_file = None
+        with open(filename, newline='', encoding='utf-8') as file:
+            try:
+                for records, errors in validate_batches(read_contact_rows(file, file_format), batch_size, workers):
+                    imported += self.add_records(records)
+                    if errors:
+                        if report_file is None:
+                            report_file = open(rejected_filename, 'w', newline='', encoding='utf-8')
+                            report = csv.writer(report_file)
+                            report.writerow(['line', 'error'])
+                        report.writerows(errors)
+                        rejected += len(errors)
+            finally:
+                if report_file is not None:
+                    report_file.close()
+        return imported, rejected
+
+    def export_contacts(self, filename):
+        exported = 0
+        with open(filename, 'w', newline='', encoding='utf-8') as file:
+            if contact_file_format(filename) == 'csv':
+                writer = csv.DictWriter(file, fieldnames=CONTACT_FIELDS)
+                writer.writeheader()
+                for record in self.iter_records():
+                    writer.writerow(row_to_csv(record_to_row(record)))
+                    exported += 1
+            else:
+                for record in self.iter_records():
+                    file.write(json.dumps(record_to_row(record), ensure_ascii=False) + '\n')
+                    exported += 1
+        return exported
+
+    def compact(self, indexes=True):
+        # Fold the journal into a new snapshot, waiting for a background compaction if one is running.
+        # With indexes the derived indexes are saved next to it; only do that while nothing else changes the book
+        if self._journal is None:
+            return
+        running = self._compaction
+        if running is not None:
+            running.join()
+        with self._journal_lock:
+            self._compaction = threading.current_thread()
+        return self._compact(indexes)
+
+    def _compact(self, indexes=False):
+        old_journal = self._journal_path + '.old'
+        view = None
+        try:
+            # Same order as a change, which logs to the journal while it holds the change lock
+            with self._change_lock, self._journal_lock:
+                if not isinstance(self.data, MappedRecords):
+                    view = self._open_snapshot()
+                    if indexes:
+                        indexes = pickle.dumps(self.index_state(), protocol=pickle.HIGHEST_PROTOCOL)
+                self._journal.close()
+                if os.path.exists(old_journal):
+                    # An earlier compaction did not finish, keep its entries in front of ours
+                    with open(old_journal, 'ab') as old, open(self._journal_path, 'rb') as current:
+                        old.write(current.read())
+                    os.remove(self._journal_path)
+                else:
+                    os.replace(self._journal_path, old_journal)
+                self._journal = open(self._journal_path, 'ab')
+                self._journal_entries = 0
+            if view is None:
+                self.data.save(self._snapshot_path)
+            else:
+                self.last_snapshot = write_snapshot(self._snapshot_path, view, self._compression)
+                if indexes:
+                    write_index_cache(self._snapshot_path, indexes)
+            # The folded entries lead from <snapshot>.prev to the new snapshot, needed if it turns out damaged
+            os.replace(old_journal, self._journal_path + '.prev')
+            return self.last_snapshot
+        finally:
+            if view is not None:
+                with self._change_lock:
+                    self._snapshot_views.remove(view)
+            with self._journal_lock:
+                self._compaction = None
+
+    def close_journal(self):
+        if self._journal is None:
+            return
+        running = self._compaction
+        if running is not None:
+            running.join()
+        self._journal.close()
+        self._journal = None
+
+    def replay_journal(self, path):
+        # Entries are idempotent puts and deletes; a torn entry at the end is cut off
+        good_offset = 0
+        with open(path, 'r+b') as file:
+            while True:
+                try:
+                    op, name, *record = unpickle(file)
+                except EOFError:
+                    break
+                except (pickle.UnpicklingError, ValueError, IndexError):
+                    file.truncate(good_offset)
+                    break
+                if op == 'put':
+                    self[name] = record[0]
+                elif name in self.data:
+                    del self[name]
+                good_offset = file.tell()
+
+    def upcoming_birthdays(self, days=7, today=None):
+        # Walks the calendar day by day, so the cost depends on days and hits, not on the book size
+        today = today or date.today()
+        index = self._record_index('_birthdays')
+        upcoming = []
+        for offset, day, keys in birthday_calendar(today, days):
+            for key in keys:
+                for name, ordinal in index.get(key, {}).items():
+                    birthday = date.fromordinal(ordinal)
+                    upcoming.append(UpcomingBirthday(name, birthday, day, offset, day.year - birthday.year))
+        return upcoming
+
+    def iter_birthdays(self):
+        # (name, birthday as ordinal day) pairs straight from the birthday index
+        for members in self._record_index('_birthdays').values():
+            yield from members.items()
+
+    def get_birthdays_per_week(self):
+        birthdays_per_week = defaultdict(list)
+        for upcoming in self.upcoming_birthdays(days=7):
+            day = upcoming.date
+            if day.weekday() >= 5:
+                day += timedelta(days=7 - day.weekday())  # weekend birthdays are greeted on Monday
+            birthdays_per_week[day.strftime("%A")].append(upcoming.name)
+                    
+        if any(birthdays_per_week.values()):
+            print("Birthdays in the next week:")
+            for day, names in birthdays_per_week.items():
+                if names:
+                    print(f"{day}: {', '.join(names)}")
+        else:
+            print("No birthdays in the next week.")
+
+    def when_birthdays(self):
+        for upcoming in self.upcoming_birthdays(days=366):
+            birthday = upcoming.birthday.strftime("%d.%m.") + f"{upcoming.birthday.year:04d}"
+            print(f"{upcoming.name}'s birthday is on {birthday}. It's in {upcoming.days} days.")
+
+    def remove_contact(self, name):
+        if name in self.data:
+            del self[name]
+            print(f"Contact {name} deleted.")
+        else:
+            print("Contact not found.")
+
+    def remove_birthday(self, name):
+        record = self.find(name)
+        if record:
+            if record.birthday:
+                with record._changing():
+                    record.birthday = None
+                print(f"Birthday removed for contact {name}")
+            else:
+                print(f"No birthday set for {name}")
+        else:
+            print(f"Contact {name} not found.")
+
+    def find_notes_by_tag(self, tag):
+        return list(self._record_index('_tags').get(tag.casefold(), ()))
+
+    def find_contacts_by_tag(self, tag):
+        hits = self._record_index('_tags').get(tag.casefold(), ())
+        return list(dict.fromkeys(name for name, _ in hits))
+
+    def find_notes(self, query, limit=None):
+        # Every word must match (a word ending in '*' matches as a prefix). Notes are ranked by
+        # how often the words occur in them, with rare words weighing more than common ones.
+        index = self._record_index('_note_words')
+        vocabulary = self._sorted_keys['_note_words']
+        matches = []
+        for term in query.split():
+            prefix = term.endswith('*')
+            for word in tokenize(term):
+                if prefix:
+                    words = vocabulary[bisect_left(vocabulary, word):bisect_left(vocabulary, word + '\U0010ffff')]
+                else:
+                    words = [word] if word in index else []
+                postings = Counter()
+                for matched_word in words:
+                    postings.update(index[matched_word])
+                matches.append(postings)
+        if not matches:
+            return []
+        matches.sort(key=len)
+        candidates = set(matches[0]).intersection(*matches[1:])
+        scored = []
+        for member in candidates:
+            score = sum((1 + math.log(postings[member])) / math.log(2 + len(postings)) for postings in matches)
+            scored.append((score, member))
+        scored.sort(key=lambda item: (-item[0], item[1]))
+        return [(name, note, score) for score, (name, note) in scored[:limit]]
+
+    def who_has_phone(self, phone):
+        return list(self._record_index('_phones').get(Record._phone_key(phone), ()))
+
+    def who_has_email(self, email):
+        return list(self._record_index('_emails').get(Record._email_key(email), ()))
+
+    def duplicate_contacts(self):
+        return group_shared_values((self._record_index('_phones'), self._record_index('_emails')))
+
+    def enable_history(self, limit=1000):
+        self._history = History(limit)
+
+    def recording(self, label):
+        # Groups the changes made inside the block into one undo step
+        return self._history.step(label) if self._history is not None else nullcontext()
+
+    def history_steps(self):
+        return list(self._history.undo_steps) if self._history is not None else []
+
+    def undo(self):
+        return self._replay(undo=True)
+
+    def redo(self):
+        return self._replay(undo=False)
+
+    def _replay(self, undo):
+        # Puts the recorded states back through __setitem__/__delitem__, so indexes and journal follow
+        history = self._history
+        if history is None:
+            return None
+        source, target = (history.undo_steps, history.redo_steps) if undo else (history.redo_steps, history.undo_steps)
+        if not source:
+            return None
+        step = source.pop()
+        history.replaying = True
+        try:
+            for change in (reversed(step.changes) if undo else step.changes):
+                state = change.before if undo else change.after
+                if state is not None:
+                    self[change.name] = pickle.loads(state)
+                elif change.name in self.data:
+                    del self[change.name]
+        finally:
+            history.replaying = False
+        target.append(step)
+        return step
+
+    def as_of(self, moment):
+        # Read-only view of the book at a POSIX timestamp; walks back only over the changes made since
+        history = self._history
+        if history is None:
+            raise ValueError("History is not recorded for this address book")
+        if moment < history.since:
+            raise ValueError(f"History only goes back to {datetime.fromtimestamp(history.since):%Y-%m-%d %H:%M:%S}")
+        overlay = {}
+        for change in reversed(history.timeline):
+            if change.time <= moment:
+                break
+            overlay[change.name] = change.before  # ends with the state before the first later change
+        return HistoricalView(self, overlay)
+
+
+class OverlayRecords(Mapping):
+    # The live book's records, except for the names in overlay, which map to their pickled past state
+    # (None when the contact did not exist then)
+    def __init__(self, live, overlay):
+        self.live = live
+        self.overlay = overlay
+        self._decoded = {}
+        self._length = (len(live) - sum(1 for name in overlay if name in live)
+                        + sum(1 for state in overlay.values() if state is not None))
+
+    def __getitem__(self, name):
+        if name not in self.overlay:
+            return self.live[name]
+        record = self._decoded.get(name)
+        if record is None:
+            state = self.overlay[name]
+            if state is None:
+                raise KeyError(name)
+            record = self._decoded[name] = pickle.loads(state)
+        return record
+
+    def __contains__(self, name):
+        if name in self.overlay:
+            return self.overlay[name] is not None
+        return name in self.live
+
+    def __iter__(self):
+        for name in self.live:
+            if name not in self.overlay:
+                yield name
+        for name, state in self.overlay.items():
+            if state is not None:
+                yield name
+
+    def __len__(self):
+        return self._length
+
+
+class HistoricalView(AddressBook):
+    # AddressBook as it was at some moment. Unchanged records are the live book's own objects, so the
+    # view only costs the changed records; its record indexes are built when a query needs them.
+    def __init__(self, live, overlay):
+        super().__init__()
+        self.data = OverlayRecords(live.data, overlay)
+        self._live = live
+        for attribute in self._record_indexes:
+            setattr(self, attribute, None)
+
+    def __setitem__(self, name, record):
+        raise TypeError("A past state of the address book cannot be changed")
+
+    def __delitem__(self, name):
+        raise TypeError("A past state of the address book cannot be changed")
+
+    def _matching_names(self, name):
+        overlay = self.data.overlay
+        for contact_name in self._live._matching_names(name):
+            if contact_name not in overlay:
+                yield contact_name
+        query = name.casefold()
+        for contact_name, state in overlay.items():
+            if state is not None and query in contact_name.casefold():
+                yield contact_name
+
+    def _sorted_listing(self):
+        if self._listing is None:
+            overlay = self.data.overlay
+            live = (entry for entry in self._live._sorted_listing() if entry[1] not in overlay)
+            restored = sorted((name.casefold(), name) for name, state in overlay.items() if state is not None)
+            self._listing = list(heapq.merge(live, restored))
+        return self._listing
+
+
+# The methods the commands call show up in the stats command as AddressBook.<method>
+for method_name in ('add_record', 'find', 'iter_findname', 'findname', 'iter_sorted_records', 'render',
+                    'remove_contact', 'remove_birthday', 'find_notes_by_tag', 'find_contacts_by_tag', 'find_notes',
+                    'who_has_phone', 'who_has_email', 'duplicate_contacts', 'upcoming_birthdays', 'iter_birthdays',
+                    'get_birthdays_per_week', 'when_birthdays', 'import_contacts', 'export_contacts',
+                    'save_to_file', 'compact'):
+    setattr(AddressBook, method_name,
+            METRICS.instrument(f"AddressBook.{method_name}")(getattr(AddressBook, method_name)))
+
+
+MAPPED_MAGIC = b'ABMAP01\n'
+MAPPED_HEADER = struct.Struct('<8sQQ')  # magic, offset and length of the name -> (offset, length) index
+
+
+def write_mapped_file(filename, entries):
+    # entries are (name, Record) pairs, or (name, bytes) for records that are already pickled
+    offsets = {}
+    with open(filename, 'wb') as file:
+        file.write(MAPPED_HEADER.pack(MAPPED_MAGIC, 0, 0))
+        for name, record in entries:
+            blob = record if isinstance(record, bytes) else pickle.dumps(record, protocol=pickle.HIGHEST_PROTOCOL)
+            offsets[name] = (file.tell(), len(blob))
+            file.write(blob)
+        index = pickle.dumps(offsets, protocol=pickle.HIGHEST_PROTOCOL)
+        index_offset = file.tell()
+        file.write(index)
+        file.seek(0)
+        file.write(MAPPED_HEADER.pack(MAPPED_MAGIC, index_offset, len(index)))
+        file.flush()
+        os.fsync(file.fileno())
+
+
+class MappedRecords(MutableMapping):
+    # name -> Record mapping over an mmapped file, records are unpickled on first access
+    def __init__(self, filename, book=None):
+        self.filename = filename
+        self.book = book
+        self._lock = threading.RLock()
+        self._open()
+        self._records = dict.fromkeys(self._offsets)  # None until the record is decoded or replaced
+
+    def _open(self):
+        self._file = open(self.filename, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, index_offset, index_length = MAPPED_HEADER.unpack_from(self._map, 0)
+        if magic != MAPPED_MAGIC:
+            self.close()
+            raise ValueError(f"{self.filename} is not a mapped address book")
+        self._offsets = pickle.loads(self._map[index_offset:index_offset + index_length])
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+    def _raw(self, name):
+        with self._lock:
+            offset, length = self._offsets[name]
+            return self._map[offset:offset + length]
+
+    def peek(self, name):
+        record = self._records[name]
+        return unpickle(io.BytesIO(self._raw(name))) if record is None else record
+
+    def __getitem__(self, name):
+        record = self._records[name]
+        if record is None:
+            record = unpickle(io.BytesIO(self._raw(name)))
+            record._book = self.book
+            self._records[name] = record
+        return record
+
+    def __setitem__(self, name, record):
+        self._records[name] = record
+
+    def __delitem__(self, name):
+        del self._records[name]
+
+    def __contains__(self, name):
+        return name in self._records
+
+    def __iter__(self):
+        return iter(self._records)
+
+    def __len__(self):
+        return len(self._records)
+
+    def save(self, filename):
+        # Untouched records are copied as raw bytes, only decoded ones are pickled again
+        with self._lock:
+            entries = list(self._records.items())
+        temp_path = filename + '.tmp'
+        write_mapped_file(temp_path, ((name, self._raw(name) if record is None else record)
+                                      for name, record in entries))
+        if os.path.abspath(filename) != os.path.abspath(self.filename):
+            os.replace(temp_path, filename)
+            return
+        with self._lock:
+            self.close()  # the old file has to be unmapped before it can be replaced on Windows
+            os.replace(temp_path, filename)
+            self._open()
+
+
+def open_mapped_address_book(filename):
+    book = AddressBook()
+    book.data = MappedRecords(filename, book)
+    for attribute in book._record_indexes:
+        setattr(book, attribute, None)
+    for name in book.data:
+        book._index_name(name)
+    return book
+
+
+def convert_to_mapped(source, target):
+    # Reads a snapshot, plain pickle or mapped file and writes its contacts in the memory-mapped format
+    book = read_address_book(source)
+    temp_path = target + '.tmp'
+    write_mapped_file(temp_path, ((record.name.value, record) for record in book.iter_records()))
+    os.replace(temp_path, target)
+    print(f"Converted {len(book)} contacts from {source} to {target}")
+
+
+SNAPSHOT_MAGIC = b'ABSNAP1\n'
+SNAPSHOT_HEADER = struct.Struct('<8s4sQQI')  # magic, compression, records, payload length, crc32 of the payload
+SNAPSHOT_COMPRESSION = {
+    'zlib': (lambda: zlib.compressobj(6), zlib.decompress),
+    'lzma': (lzma.LZMACompressor, lzma.decompress),
+}
+SnapshotStats = namedtuple('SnapshotStats', 'filename records raw_bytes bytes seconds compression')
+
+
+class SnapshotView:
+    # Frozen copy of the book's name -> Record mapping while a snapshot is written. Records are pickled
+    # one by one; a record that is about to change before its turn is pickled first, so the file keeps
+    # the state the book had when the snapshot started
+    def __init__(self, data):
+        self._pending = dict(data)  # records not written yet
+        self._names = list(self._pending)  # from the same copy, so every name has its record
+        self._preserved = {}  # name -> pickled (name, record) taken before a change
+        self._lock = threading.Lock()
+
+    def preserve(self, name):
+        with self._lock:
+            record = self._pending.pop(name, None)
+            if record is not None:
+                self._preserved[name] = pickle.dumps((name, record), protocol=pickle.HIGHEST_PROTOCOL)
+
+    def __len__(self):
+        return len(self._names)
+
+    def __iter__(self):
+        for name in self._names:
+            with self._lock:
+                blob = self._preserved.pop(name, None)
+                if blob is None:
+                    blob = pickle.dumps((name, self._pending.pop(name)), protocol=pickle.HIGHEST_PROTOCOL)
+            yield blob
+
+
+def write_snapshot(filename, view, compression='zlib'):
+    # Compresses the pickled records into <filename>.tmp, fsyncs it and renames it into place.
+    # The snapshot it replaces is kept as <filename>.prev
+    started = time.perf_counter()
+    compressor = SNAPSHOT_COMPRESSION[compression][0]()
+    temp_path = filename + '.tmp'
+    raw_bytes = length = checksum = 0
+    with open(temp_path, 'wb') as file:
+        file.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, b'', 0, 0, 0))
+
+        def write(chunk):
+            nonlocal length, checksum
+            file.write(chunk)
+            length += len(chunk)
+            checksum = zlib.crc32(chunk, checksum)
+
+        pending = []
+        pending_bytes = 0
+        for blob in view:
+            pending.append(blob)
+            pending_bytes += len(blob)
+            if pending_bytes >= 1 << 20:  # compressing in 1 MiB pieces is much cheaper than per record
+                write(compressor.compress(b''.join(pending)))
+                raw_bytes += pending_bytes
+                pending = []
+                pending_bytes = 0
+        write(compressor.compress(b''.join(pending)))
+        raw_bytes += pending_bytes
+        write(compressor.flush())
+        file.seek(0)
+        file.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, compression.encode('ascii'), len(view), length, checksum))
+        file.flush()
+        os.fsync(file.fileno())
+    if os.path.exists(filename):
+        os.replace(filename, filename + '.prev')
+    os.replace(temp_path, filename)
+    return SnapshotStats(filename, len(view), raw_bytes, SNAPSHOT_HEADER.size + length,
+                         time.perf_counter() - started, compression)
+
+
+def read_snapshot(file):
+    _, compression, records, length, checksum = SNAPSHOT_HEADER.unpack(file.read(SNAPSHOT_HEADER.size))
+    payload = file.read()
+    if len(payload) != length or zlib.crc32(payload) != checksum:
+        raise ValueError("checksum mismatch")
+    decompress = SNAPSHOT_COMPRESSION.get(compression.rstrip(b'\0').decode('ascii', errors='replace'))
+    if decompress is None:
+        raise ValueError(f"unknown compression {compression!r}")
+    stream = io.BytesIO(decompress[1](payload))
+    data = {}
+    for _ in range(records):
+        name, record = unpickle(stream)
+        data[name] = record
+    return data
+
+
+INDEX_CACHE_VERSION = 1  # part of the key of <snapshot>.index, bump it when the indexes change shape
+
+
+def index_cache_key(filename):
+    # Size, modification time and header (record count and crc32 of the payload) of the snapshot,
+    # so indexes saved for one generation of the file are never used with another
+    status = os.stat(filename)
+    with open(filename, 'rb') as file:
+        header = file.read(SNAPSHOT_HEADER.size)
+    return (INDEX_CACHE_VERSION, status.st_size, status.st_mtime_ns, header)
+
+
+def write_index_cache(filename, indexes):
+    # indexes is the pickled AddressBook.index_state() of the book that was just written to filename
+    temp_path = filename + '.index.tmp'
+    with open(temp_path, 'wb') as file:
+        pickle.dump(index_cache_key(filename), file, protocol=pickle.HIGHEST_PROTOCOL)
+        file.write(indexes)
+    os.replace(temp_path, filename + '.index')
+
+
+def read_index_cache(filename):
+    # The saved indexes of the snapshot, None when there are none or they belong to another version of it
+    try:
+        with open(filename + '.index', 'rb') as file:
+            if pickle.load(file) != index_cache_key(filename):
+                return None
+            return pickle.load(file)
+    except FileNotFoundError:
+        return None
+    except (EOFError, ValueError, pickle.UnpicklingError) as error:
+        print(f"Warning: {filename}.index could not be read ({error}), rebuilding the indexes.")
+        return None
+
+
+@contextmanager
+def gc_paused():
+    # Loading creates millions of objects that all stay alive, collecting in between only costs time
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def read_address_book(filename):
+    # Snapshots, memory-mapped books and the plain pickles of older versions are told apart by their start
+    with open(filename, 'rb') as file:
+        magic = file.read(len(SNAPSHOT_MAGIC))
+        file.seek(0)
+        if magic == SNAPSHOT_MAGIC:
+            data = read_snapshot(file)
+        elif magic != MAPPED_MAGIC:
+            data = unpickle(file)
+    if magic == MAPPED_MAGIC:
+        return open_mapped_address_book(filename)
+    if magic == SNAPSHOT_MAGIC:
+        state = read_index_cache(filename)
+        if state is not None:
+            return AddressBook.from_index_state(data, state)
+    return AddressBook(data)  # Goes through __setitem__, so the indexes are rebuilt
+
+
+def load_address_book_from_file(filename, journal=False, compression='zlib'):
+    # A missing or damaged snapshot falls back to the previous generation plus the journal that follows it
+    generations = ((filename, ('.journal.old', '.journal')),
+                   (filename + '.prev', ('.journal.prev', '.journal.old', '.journal')))
+    book = None
+    for path, journals in generations:
+        try:
+            with gc_paused():
+                book = read_address_book(path)
+            break
+        except FileNotFoundError:
+            continue
+        except (EOFError, ValueError, struct.error, pickle.UnpicklingError, zlib.error, lzma.LZMAError) as error:
+            print(f"Warning: {path} could not be read ({error}).")
+    if book is None:
+        book = AddressBook()
+    elif path != filename:
+        print(f"Loaded the previous generation of the address book from {path}.")
+    if journal:
+        for extension in journals:
+            if os.path.exists(filename + extension):
+                book.replay_journal(filename + extension)
+        book.open_journal(filename, compression=compression)
+    return book
+
+CONTACT_FIELDS = ('name', 'phones', 'emails', 'addresses', 'birthday', 'notes')
+
+
+def contact_file_format(filename):
+    extension = os.path.splitext(filename)[1].lower()
+    if extension == '.csv':
+        return 'csv'
+    if extension in ('.jsonl', '.json'):
+        return 'jsonl'
+    raise ValueError(f"Unsupported file type '{extension}', use .csv or .jsonl")
+
+
+def record_to_row(record):
+    return {
+        'name': record.name.value,
+        'phones': [phone.value for phone in record.phones],
+        'emails': [email.value for email in record.emails],
+        'addresses': [address.value for address in record.addresses],
+        'birthday': record.birthday.value if record.birthday else None,
+        'notes': {note: list(tags) for note, tags in record.notes.items()},
+    }
+
+
+def row_to_csv(row):
+    # Lists are joined with ';' like in the add command, notes keep their tags as JSON
+    return {
+        'name': row['name'],
+        'phones': ';'.join(row['phones']),
+        'emails': ';'.join(row['emails']),
+        'addresses': ';'.join(row['addresses']),
+        'birthday': row['birthday'] or '',
+        'notes': json.dumps(row['notes'], ensure_ascii=False) if row['notes'] else '',
+    }
+
+
+def csv_to_row(csv_row):
+    def split(value):
+        return [part.strip() for part in (value or '').split(';') if part.strip()]
+    return {
+        'name': (csv_row.get('name') or '').strip(),
+        'phones': split(csv_row.get('phones')),
+        'emails': split(csv_row.get('emails')),
+        'addresses': split(csv_row.get('addresses')),
+        'birthday': (csv_row.get('birthday') or '').strip() or None,
+        'notes': json.loads(csv_row['notes']) if csv_row.get('notes') else {},
+    }
+
+
+def read_contact_rows(file, file_format):
+    # Yields (line number, row) pairs; rows that cannot be parsed are yielded as the exception
+    if file_format == 'csv':
+        reader = csv.DictReader(file)
+        for csv_row in reader:
+            try:
+                yield reader.line_num, csv_to_row(csv_row)
+            except ValueError as error:
+                yield reader.line_num, error
+    else:
+        for line_number, line in enumerate(file, 1):
+            if not line.strip():
+                continue
+            try:
+                yield line_number, json.loads(line)
+            except ValueError as error:
+                yield line_number, error
+
+
+def field_list(values):
+    # List fields may hold a single value as well: "phones": "0123456789" is one phone, not ten digits
+    if not values:
+        return []
+    if isinstance(values, (str, int)):
+        return [values]
+    return list(values)
+
+
+def row_to_record(row):
+    if not isinstance(row, dict):
+        raise ValueError("Row must be an object")
+    if not isinstance(row.get('name'), str):
+        raise ValueError("Name field is required")
+    record = Record(row['name'])
+    for phone in field_list(row.get('phones')):
+        record.add_phone(phone)
+    for email in field_list(row.get('emails')):
+        record.add_email(email)
+    for address in field_list(row.get('addresses')):
+        record.add_address(address)
+    if row.get('birthday'):
+        record.add_birthday(row['birthday'])
+    notes = row.get('notes') or {}
+    if not isinstance(notes, dict):
+        raise ValueError("Notes must be an object of note: tags")
+    for note, tags in notes.items():
+        tags = field_list(tags) if isinstance(tags, (str, list, tuple, type(None))) else [tags]
+        if not all(isinstance(tag, str) for tag in tags):
+            raise ValueError(f"Tags of note '{note}' must be strings")
+        record.add_notes(note, tags)
+    return record
+
+
+def row_field_values(row, field):
+    values = row.get(field) if isinstance(row, dict) else None
+    if not isinstance(values, (str, int, list, tuple)):
+        return []  # anything else is rejected when the record is built
+    return [value for value in field_list(values) if isinstance(value, (str, int))]
+
+
+def validate_batch(batch):
+    # The phones, emails and birthdays of the whole batch go through validate_many first, so a value
+    # repeated across rows is checked once and building the records below only hits the caches
+    for field, kind in (('phones', 'phone'), ('emails', 'email'), ('birthday', 'birthday')):
+        validate_many(kind, [value for _, row in batch for value in row_field_values(row, field)])
+    records = []
+    errors = []
+    for line_number, row in batch:
+        if isinstance(row, Exception):
+            errors.append((line_number, f"Unreadable row: {row}"))
+            continue
+        try:
+            records.append(row_to_record(row))
+        except (ValueError, TypeError, AttributeError) as error:
+            errors.append((line_number, str(error)))
+    return records, errors
+
+
+def validate_batches(rows, batch_size=1000, workers=0):
+    # With workers the batches are validated in a process pool, keeping only a few batches in flight
+    batches = iter(lambda: list(islice(rows, batch_size)), [])
+    if not workers:
+        for batch in batches:
+            yield validate_batch(batch)
+        return
+    from concurrent.futures import ProcessPoolExecutor  # costs more to import than the rest of the startup
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for batch in batches:
+            pending.append(pool.submit(validate_batch, batch))
+            if len(pending) >= workers * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
@@ -0,0 +1,153 @@
+import calendar
+from datetime import date
+
+try:
+    import numpy as np
+except ImportError:  # only the birthday reports need NumPy, the address book itself runs without it
+    np = None
+
+from addressbook import UpcomingBirthday, birthday_horizon
+
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+MONTH_NAMES = ["January", "February", "March", "April", "May", "June", "July", "August", "September",
+               "October", "November", "December"]
+
+
+class BirthdayColumns:
+    # Column snapshot of a book's birthdays: names[i] was born on days[i]. Every report is a handful
+    # of array operations over these columns instead of a loop over the records.
+    def __init__(self, names, ordinals):
+        if np is None:
+            raise ImportError("The birthday reports need NumPy, install it with 'pip install numpy'.")
+        self.names = np.array(names, dtype=object)
+        self.days = (np.asarray(ordinals, dtype=np.int64) - EPOCH_ORDINAL).astype('datetime64[D]')
+        months = self.days.astype('datetime64[M]')
+        self.years = months.astype('datetime64[Y]').astype(np.int64) + 1970
+        self.months = months.astype(np.int64) % 12 + 1
+        self.month_days = (self.days - months.astype('datetime64[D]')).astype(np.int64) + 1
+        self._year_days = {}  # leap year or not -> day of the year each birthday falls on
+
+    @classmethod
+    def from_book(cls, book):
+        pairs = list(book.iter_birthdays())
+        return cls([name for name, _ in pairs], [ordinal for _, ordinal in pairs])
+
+    @classmethod
+    def of(cls, book):
+        # In-memory books count their changes, so the columns are only rebuilt after something changed
+        version = getattr(book, '_version', None)
+        cached = getattr(book, '_birthday_columns', None)
+        if version is not None and cached is not None and cached[0] == version:
+            return cached[1]
+        columns = cls.from_book(book)
+        if version is not None:
+            book._birthday_columns = (version, columns)
+        return columns
+
+    def __len__(self):
+        return len(self.names)
+
+    def per_month(self):
+        return np.bincount(self.months, minlength=13)[1:]
+
+    def ages(self, today):
+        had_birthday = (self.months < today.month) | ((self.months == today.month) & (self.month_days <= today.day))
+        return today.year - self.years - (~had_birthday).astype(np.int64)
+
+    def age_distribution(self, today, width=10):
+        # [(first age of the bucket, contacts)] for the buckets that are not empty
+        counts = np.bincount(np.maximum(self.ages(today), 0) // width)
+        return [(bucket * width, int(count)) for bucket, count in enumerate(counts) if count]
+
+    def _occurrences(self, year):
+        # Ordinal days of the birthdays in the given year; 29 February falls on the 28th in common years.
+        # Only two tables exist (leap and common year), so they are built once and reused
+        leap = calendar.isleap(year)
+        year_days = self._year_days.get(leap)
+        if year_days is None:
+            lengths = np.array([calendar.monthrange(2024 if leap else 2023, month)[1] for month in range(1, 13)])
+            starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+            month = self.months - 1
+            year_days = (starts[month] + np.minimum(self.month_days, lengths[month]) - 1).astype(np.int32)
+            self._year_days[leap] = year_days
+        return date(year, 1, 1).toordinal() + year_days
+
+    def _hits(self, indexes, occurrences, today):
+        days = (occurrences - EPOCH_ORDINAL).astype('datetime64[D]')
+        ages = days.astype('datetime64[Y]').astype(np.int64) + 1970 - self.years[indexes]
+        offsets = occurrences - today.toordinal()
+        return list(map(UpcomingBirthday, self.names[indexes].tolist(), self.days[indexes].tolist(), days.tolist(),
+                        offsets.tolist(), ages.tolist()))
+
+    def upcoming(self, days=7, today=None):
+        # Same results as AddressBook.upcoming_birthdays, including its one year cap
+        today = today or date.today()
+        occurrences = self._occurrences(today.year)
+        passed = occurrences < today.toordinal()
+        occurrences = np.where(passed, self._occurrences(today.year + 1), occurrences)
+        offsets = occurrences - today.toordinal()
+        hits = np.flatnonzero(offsets < birthday_horizon(today, days))
+        hits = hits[np.lexsort((hits, self.month_days[hits], offsets[hits]))]
+        return self._hits(hits, occurrences[hits], today)
+
+    def round_ages(self, today=None, every=10):
+        # Contacts whose birthday in the current quarter makes their age a multiple of `every`
+        today = today or date.today()
+        quarter = (today.month - 1) // 3
+        ages = today.year - self.years
+        hits = np.flatnonzero(((self.months - 1) // 3 == quarter) & (ages > 0) & (ages % every == 0))
+        occurrences = self._occurrences(today.year)[hits]
+        order = np.lexsort((hits, occurrences))
+        return self._hits(hits[order], occurrences[order], today)
+
+
+def print_per_month(columns, today=None):
+    print("Birthdays per month:")
+    for month, total in zip(MONTH_NAMES, columns.per_month().tolist()):
+        print(f"{month}: {total}")
+
+
+def print_age_distribution(columns, today=None, width=10):
+    print("Age distribution:")
+    for first_age, total in columns.age_distribution(today or date.today(), width):
+        print(f"{first_age}-{first_age + width - 1}: {total}")
+
+
+def print_round_ages(columns, today=None):
+    hits = columns.round_ages(today)
+    if not hits:
+        print("Nobody turns a round age this quarter.")
+        return
+    print("Round ages this quarter:")
+    for hit in hits:
+        print(f"{hit.name} turns {hit.age} on {hit.date.strftime('%d.%m.')}")
+
+
+def print_birthdays_per_week(columns, today=None):
+    # Same output as AddressBook.get_birthdays_per_week
+    birthdays_per_week = {}
+    for hit in columns.upcoming(7, today):
+        day = np.busday_offset(np.datetime64(hit.date, 'D'), 0, roll='forward')  # weekends move to Monday
+        birthdays_per_week.setdefault(day.item().strftime("%A"), []).append(hit.name)
+    if birthdays_per_week:
+        print("Birthdays in the next week:")
+        for day, names in birthdays_per_week.items():
+            print(f"{day}: {', '.join(names)}")
+    else:
+        print("No birthdays in the next week.")
+
+
+def print_when_birthdays(columns, today=None):
+    # Same output as AddressBook.when_birthdays
+    for hit in columns.upcoming(366, today):
+        print(f"{hit.name}'s birthday is on {hit.birthday.strftime('%d.%m.')}{hit.birthday.year:04d}. "
+              f"It's in {hit.days} days.")
+
+
+BIRTHDAY_REPORTS = {
+    'months': print_per_month,
+    'ages': print_age_distribution,
+    'round': print_round_ages,
+    'week': print_birthdays_per_week,
+    'when': print_when_birthdays,
+}
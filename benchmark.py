@@ -0,0 +1,247 @@
+import argparse
+from contextlib import redirect_stdout
+from datetime import date
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from addressbook import AddressBook, Record, load_address_book_from_file, record_footprint
+
+FIRST_NAMES = ["Artur", "Michal", "Monika", "Anna", "Piotr", "Kasia", "Tomasz", "Ewa", "Jan", "Ola",
+               "Pawel", "Marta", "Adam", "Zofia", "Krzysztof", "Julia", "Marek", "Agnieszka"]
+LAST_NAMES = ["Laski", "Misterkiewicz", "Nowak", "Kowalski", "Wisniewski", "Wojcik", "Kaminski",
+              "Lewandowski", "Zielinski", "Szymanski", "Wozniak", "Dabrowski", "Kozlowski"]
+CITIES = ["Katowice", "Sosnowiec", "Krakow", "Warszawa", "Gdansk", "Poznan", "Wroclaw", "Lodz"]
+TAGS = ["family", "friend", "work", "c++", "python", "gym", "school", "wife", "neighbour", "client",
+        "vip", "supplier", "football", "music", "travel"]
+
+
+def parse_size(text):
+    # Accepts plain numbers as well as 10k / 1m
+    text = text.strip().lower()
+    multiplier = {'k': 1_000, 'm': 1_000_000}.get(text[-1:], 1)
+    return int(float(text.rstrip('km')) * multiplier)
+
+
+def generate_records(size, seed=0):
+    rng = random.Random(seed)
+    first_day = date(1940, 1, 1).toordinal()
+    last_day = date(2010, 12, 31).toordinal()
+    for number in range(size):
+        first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+        record = Record(f"{first} {last} {number}")
+        for _ in range(rng.randint(1, 3)):
+            record.add_phone(f"{rng.randrange(10 ** 10):010d}")
+        record.add_email(f"{first.lower()}.{last.lower()}{number}@example.com")
+        record.add_address(rng.choice(CITIES))
+        if rng.random() < 0.8:
+            record.add_birthday(date.fromordinal(rng.randint(first_day, last_day)).strftime("%d.%m.%Y"))
+        for note_number in range(rng.randint(0, 3)):
+            record.add_notes(f"Note {note_number} about {first} from {rng.choice(CITIES)}",
+                             rng.sample(TAGS, rng.randint(1, 3)))
+        yield record
+
+
+def build_book(size, seed=0):
+    book = AddressBook()
+    for record in generate_records(size, seed):
+        book.add_record(record)
+    return book
+
+
+def measure(function, repeat, setup=None):
+    # Wall time comes from plain runs, the peak from one extra run under tracemalloc.
+    # setup runs untimed before each of them
+    timings = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        started = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - started)
+    if setup:
+        setup()
+    tracemalloc.start()
+    try:
+        function()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {
+        'seconds_min': min(timings),
+        'seconds_median': statistics.median(timings),
+        'peak_bytes': peak,
+        'repeat': repeat,
+    }
+
+
+def timing_summary(timings):
+    return {
+        'seconds_min': min(timings),
+        'seconds_median': statistics.median(timings),
+        'repeat': len(timings),
+    }
+
+
+PROMPT = b'Enter command: '
+
+
+def read_until_prompt(process):
+    tail = b''
+    while not tail.endswith(PROMPT):
+        chunk = os.read(process.stdout.fileno(), 1 << 16)
+        if not chunk:
+            raise RuntimeError(f"main exited before prompting, exit code {process.wait()}")
+        tail = (tail + chunk)[-len(PROMPT):]
+
+
+def time_startup(filename, command, repeat, cold=False):
+    # Starts the assistant like a user would and times the prompt and the answer to the first command.
+    # Cold starts delete the saved indexes first; every run saves them again when it exits
+    to_prompt = []
+    to_answer = []
+    environment = dict(os.environ, PYTHONUNBUFFERED='1')
+    for _ in range(repeat):
+        if cold and os.path.exists(filename + '.index'):
+            os.remove(filename + '.index')
+        started = time.perf_counter()
+        process = subprocess.Popen([sys.executable, '-m', 'main', '--file', filename, '--interactive'],
+                                   cwd=os.path.dirname(os.path.abspath(__file__)), env=environment,
+                                   stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        try:
+            read_until_prompt(process)
+            to_prompt.append(time.perf_counter() - started)
+            process.stdin.write(command.encode('utf-8') + b'\n')
+            process.stdin.flush()
+            read_until_prompt(process)
+            to_answer.append(time.perf_counter() - started)
+        finally:
+            process.communicate(b'exit\n')
+    return to_prompt, to_answer
+
+
+def quiet(function, *args):
+    # The birthday reports and the listing print, the benchmark only wants their cost
+    def run():
+        with redirect_stdout(io.StringIO()):
+            function(*args)
+    return run
+
+
+def list_all(book):
+    for record in book.iter_sorted_records():
+        print(book.render(record))
+
+
+def run_benchmarks(size, seed=0, repeat=3, directory=None):
+    started = time.perf_counter()
+    book = build_book(size, seed)
+    build_seconds = time.perf_counter() - started
+    names = list(book.data)
+    rng = random.Random(seed + 1)
+    search_terms = [name.split()[1][:4] for name in rng.sample(names, min(20, len(names)))]
+    search_terms += [name.split()[2] for name in rng.sample(names, min(20, len(names)))]
+    tags = TAGS[:5]
+
+    directory = directory or tempfile.mkdtemp(prefix='addressbook-bench-')
+    filename = os.path.join(directory, 'bench.dat')
+
+    benchmarks = {
+        'findname': lambda: [book.findname(term) for term in search_terms],
+        'find_notes_by_tag': lambda: [book.find_notes_by_tag(tag) for tag in tags],
+        'find_contacts_by_tag': lambda: [book.find_contacts_by_tag(tag) for tag in tags],
+        'get_birthdays_per_week': quiet(book.get_birthdays_per_week),
+        'when_birthdays': quiet(book.when_birthdays),
+        'save_to_file': lambda: book.save_to_file(filename),
+        'load_address_book_from_file': lambda: load_address_book_from_file(filename),
+        'all': quiet(list_all, book),
+        'all_warm': quiet(list_all, book),
+    }
+    # 'all' renders every contact afresh, 'all_warm' after a listing filled the render cache. Above the
+    # cache limit the warm listing evicts its own entries, so only books up to that size get faster
+    setups = {
+        'all': book._rendered.clear,
+        'all_warm': quiet(list_all, book),
+    }
+    results = {}
+    for name, function in benchmarks.items():
+        results[name] = measure(function, repeat, setups.get(name))
+        print(f"{name}: {results[name]['seconds_min'] * 1000:.1f} ms, "
+              f"peak {results[name]['peak_bytes'] / 1024:.0f} KiB", file=sys.stderr)
+    # python -m main reuses the compiled module from __pycache__, python main.py compiles it on every start
+    startup_filename = os.path.join(directory, 'startup.dat')
+    book.save_to_file(startup_filename)
+    for label, cold in (('cold', True), ('warm', False)):
+        to_prompt, to_answer = time_startup(startup_filename, f"search {search_terms[-1]}", repeat, cold)
+        results[f'time_to_prompt_{label}'] = timing_summary(to_prompt)
+        results[f'time_to_first_command_{label}'] = timing_summary(to_answer)
+        print(f"startup ({label} indexes): prompt after {min(to_prompt) * 1000:.1f} ms, "
+              f"first command answered after {min(to_answer) * 1000:.1f} ms", file=sys.stderr)
+    sample = [book.data[name] for name in rng.sample(names, min(1000, len(names)))]
+    return {
+        'meta': {
+            'size': size,
+            'seed': seed,
+            'repeat': repeat,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'build_seconds': build_seconds,
+            'bytes_per_record': sum(record_footprint(record) for record in sample) / max(len(sample), 1),
+            'file_bytes': os.path.getsize(filename),
+        },
+        'results': results,
+    }
+
+
+def compare(report, baseline, tolerance=0.2, noise=0.001):
+    # Returns the benchmarks that got slower than the baseline by more than the tolerance,
+    # differences below the noise floor (in seconds) are ignored
+    regressions = []
+    for name, result in report['results'].items():
+        previous = baseline.get('results', {}).get(name)
+        if not previous:
+            continue
+        ratio = result['seconds_min'] / previous['seconds_min'] if previous['seconds_min'] else float('inf')
+        print(f"{name}: {ratio:.2f}x baseline", file=sys.stderr)
+        if ratio > 1 + tolerance and result['seconds_min'] - previous['seconds_min'] > noise:
+            regressions.append((name, ratio))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the AddressBook hot paths")
+    parser.add_argument('--size', type=parse_size, default=parse_size('10k'), help="contacts, e.g. 10k, 100k, 1m")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', default='benchmark.json', help="where to write the JSON results")
+    parser.add_argument('--baseline', help="JSON results of an earlier run to compare against")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="allowed slowdown before failing")
+    arguments = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory(prefix='addressbook-bench-') as directory:
+        report = run_benchmarks(arguments.size, arguments.seed, arguments.repeat, directory)
+    with open(arguments.output, 'w', encoding='utf-8') as file:
+        json.dump(report, file, indent=2)
+    print(f"Results written to {arguments.output}", file=sys.stderr)
+
+    if arguments.baseline:
+        with open(arguments.baseline, encoding='utf-8') as file:
+            baseline = json.load(file)
+        regressions = compare(report, baseline, arguments.tolerance)
+        for name, ratio in regressions:
+            print(f"Regression: {name} is {ratio:.2f}x slower than the baseline", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
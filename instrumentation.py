@@ -0,0 +1,156 @@
+from collections import deque
+from contextlib import contextmanager
+import functools
+import sys
+import threading
+import time
+
+CO_GENERATOR = 0x20  # inspect.CO_GENERATOR; inspect itself takes longer to import than this module
+
+
+class Metric:
+    __slots__ = ('calls', 'seconds', 'blocks', 'samples')
+
+    def __init__(self, keep):
+        self.calls = 0
+        self.seconds = 0.0
+        self.blocks = 0  # net memory blocks still allocated after the calls
+        self.samples = deque(maxlen=keep)  # latest latencies, the percentiles are taken from these
+
+
+def percentile(ordered, fraction):
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class Metrics:
+    # Call counts, latencies and allocated blocks per name ("command:add", "AddressBook.find", ...).
+    # Switched off by default, then a timed call only costs a flag check. Counting the allocated blocks walks
+    # every memory arena, which costs more than a small command, so it is only done while profiling.
+    def __init__(self, keep=10000):
+        self.enabled = False
+        self.track_memory = False
+        self.keep = keep
+        self._metrics = {}
+        self._lock = threading.Lock()  # the server records from several threads
+
+    def record(self, name, seconds, blocks):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = Metric(self.keep)
+            metric.calls += 1
+            metric.seconds += seconds
+            metric.blocks += blocks
+            metric.samples.append(seconds)
+
+    @contextmanager
+    def timed(self, name):
+        if not self.enabled:
+            yield
+            return
+        blocks = sys.getallocatedblocks() if self.track_memory else 0
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - started
+            self.record(name, seconds, sys.getallocatedblocks() - blocks if self.track_memory else 0)
+
+    def instrument(self, name):
+        # Decorator; for generator functions the time spent producing the items is measured
+        def decorate(function):
+            if function.__code__.co_flags & CO_GENERATOR:
+                @functools.wraps(function)
+                def wrapper(*args, **kwargs):
+                    generator = function(*args, **kwargs)
+                    return self._timed_generator(name, generator) if self.enabled else generator
+            else:
+                @functools.wraps(function)
+                def wrapper(*args, **kwargs):
+                    if not self.enabled:
+                        return function(*args, **kwargs)
+                    with self.timed(name):
+                        return function(*args, **kwargs)
+            return wrapper
+        return decorate
+
+    def _timed_generator(self, name, generator):
+        seconds = 0.0
+        blocks = 0
+        try:
+            while True:
+                before = sys.getallocatedblocks() if self.track_memory else 0
+                started = time.perf_counter()
+                try:
+                    item = next(generator)
+                except StopIteration:
+                    return
+                finally:
+                    seconds += time.perf_counter() - started
+                    if self.track_memory:
+                        blocks += sys.getallocatedblocks() - before
+                yield item
+        finally:
+            generator.close()
+            self.record(name, seconds, blocks)
+
+    def rows(self):
+        # [(name, calls, total seconds, p50, p95, p99, net blocks)], slowest in total first
+        with self._lock:
+            metrics = [(name, metric.calls, metric.seconds, sorted(metric.samples), metric.blocks)
+                       for name, metric in self._metrics.items()]
+        rows = [(name, calls, seconds, percentile(ordered, 0.5), percentile(ordered, 0.95),
+                 percentile(ordered, 0.99), blocks) for name, calls, seconds, ordered, blocks in metrics]
+        rows.sort(key=lambda row: row[2], reverse=True)
+        return rows
+
+    def report(self, file=None):
+        file = file or sys.stdout
+        rows = self.rows()
+        if not rows:
+            print("No statistics recorded yet.", file=file)
+            return
+        print(f"{'name':<36} {'calls':>8} {'total ms':>10} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} "
+              f"{'blocks':>9}", file=file)
+        for name, calls, seconds, p50, p95, p99, blocks in rows:
+            print(f"{name:<36} {calls:>8} {seconds * 1000:>10.2f} {p50 * 1000:>9.3f} {p95 * 1000:>9.3f} "
+                  f"{p99 * 1000:>9.3f} {blocks:>9}", file=file)
+
+    def reset(self):
+        with self._lock:
+            self._metrics.clear()
+
+
+METRICS = Metrics()
+
+
+@contextmanager
+def profile_session(filename, top=40):
+    # Runs the block under cProfile and tracemalloc; the command figures, the hottest functions and
+    # the biggest allocation sites go to filename, the raw profile to filename + '.prof'
+    import cProfile
+    import pstats
+    import tracemalloc
+    profiler = cProfile.Profile()
+    tracemalloc.start(10)
+    METRICS.track_memory = True
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        METRICS.track_memory = False
+        allocations = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        profiler.dump_stats(filename + '.prof')
+        with open(filename, 'w', encoding='utf-8') as file:
+            print("Commands and AddressBook methods", file=file)
+            METRICS.report(file)
+            print(f"\nMemory: {current / 1024:.0f} KiB allocated at exit, peak {peak / 1024:.0f} KiB", file=file)
+            print(f"\nTop {top} allocation sites", file=file)
+            for statistic in allocations.statistics('lineno')[:top]:
+                print(statistic, file=file)
+            print(f"\nTop {top} functions by cumulative time", file=file)
+            pstats.Stats(profiler, stream=file).sort_stats('cumulative').print_stats(top)
+        print(f"Profile written to {filename} and {filename}.prof", file=sys.stderr)
@@ -1,234 +1,17 @@
-from collections import UserDict, defaultdict
-from datetime import datetime, timedelta
-import pickle
-from difflib import get_close_matches
-
-class Field:
-    def __init__(self, value):
-        self.value = value
-
-    def __str__(self):
-        return str(self.value)
-
-class Name(Field):
-    def __init__(self, value):
-        if value:  
-            self.value = value
-        else:
-            raise ValueError("Name field is required")
+import argparse
+from collections import defaultdict, namedtuple
+from contextlib import nullcontext, redirect_stdout
+from datetime import date, datetime
+import io
+import math
+import sys
+import threading
+import time
+from functools import lru_cache
 
-class Phone(Field):
-    def __init__(self, value):
-        if self.validate_phone(value):
-            self.value = value
-        else:
-            raise ValueError("Invalid phone number: must be 10 digits")
-    
-    def validate_phone(self, phone):
-        return len(str(phone)) == 10
-    
-class Email(Field):
-    def __init__(self, value):
-        if self.validate_email(value):
-            self.value = value
-        else:
-            raise ValueError("Invalid email address")
-    
-    def validate_email(self, email):
-        # Basic email validation, can be improved
-        return "@" in email and "." in email
-    
-class Address(Field):
-    def __init__(self, value):
-        self.value = value
-
-class Notes(Field):
-    def __init__(self, value):
-        self.value = value
-
-class Birthday(Field):
-    def __init__(self, value):
-        if len(value) != 10 or not datetime.strptime(value, "%d.%m.%Y"):
-            raise ValueError("Invalidd birthday format. DD.MM.YYYY required")
-        super().__init__(value)
-
-class Record:
-    def __init__(self, name):
-        self.name = Name(name)
-        self.phones = []
-        self.emails = []
-        self.addresses = []
-        self.notes = {} #Create dictionary to make notes and his tags.
-        self.birthday = None
-
-    def add_notes(self, note, tags):
-        self.notes[note] = tags
-
-    def add_birthday(self, birthday):
-        self.birthday = Birthday(birthday)
-
-    def add_phone(self, phone):
-        self.phones.append(Phone(phone))
-        
-    def add_email(self, email):
-        self.emails.append(Email(email))
-        
-    def add_address(self, address):
-        self.addresses.append(Address(address))
-
-    def edit_phone(self, old_phone, new_phone):
-        for phone in self.phones:
-            if phone.value == old_phone:
-                phone.value = new_phone
-
-    def find_phone(self, phone_number):
-        for phone in self.phones:
-            if phone.value == phone_number:
-                return phone
-        return None
-    
-    def remove_phone(self, phone_number):
-        for phone in self.phones:
-            if phone.value == phone_number:
-                self.phones.remove(phone)
-
-    def edit_notes(self, old_note, new_note, new_tags=None):
-        if old_note in self.notes:
-            self.notes[new_note] = new_tags if new_tags is not None else self.notes[old_note]
-            if old_note != new_note:
-                del self.notes[old_note]
-            print(f"Note edited successfully: {new_note}. Tags: {', '.join(new_tags if new_tags else [])}")
-        else:
-            print(f"Note '{old_note}' not found.")
-
-    def delete_notes(self, note):
-        if note in self.notes:
-            del self.notes[note]
-            print(f"Note '{note}' deleted successfully.")
-        else:
-            print(f"Note '{note}' not found.")
-
-    def __str__(self):
-        phone_info = '; '.join(str(p) for p in self.phones)
-        email_info = '; '.join(str(e) for e in self.emails)
-        address_info = '; '.join(str(a) for a in self.addresses)
-        note_info = ''.join(f"{note}. TAGI: {', '.join(tags)}\n" for note, tags in self.notes.items())
-        birthday_info = f"Birthday: {self.birthday.value}" if self.birthday else "No birthday set"
-        return f"--------------------\nContact name: {self.name.value}, phones: {phone_info}, emails: {email_info}, address: {address_info}, {birthday_info}\nNotes:\n{note_info}"
-
-
-class AddressBook(UserDict):
-    def add_record(self, record):
-        self.data[record.name.value] = record
-    
-    def find(self, name):
-        return self.data.get(name)
-
-    def findname(self, name):
-        name_lower = name.lower()  # Przekształć szukane imię do małych liter
-        found_contacts = []
-        for contact_name, record in self.data.items():
-            if name_lower in contact_name.lower():  # Porównaj ignorując wielkość liter
-                found_contacts.append(record)
-        return found_contacts if found_contacts else None
-
-    def remove_phone(self, name):
-        if name in self.data:
-            del self.data[name]
-            print(f"Contact {name} deleted.")
-        else:
-            print("Contact not found.")
-
-    def save_to_file(self, filename):
-        with open(filename, 'wb') as file:
-            pickle.dump(self.data, file)
-
-    def get_birthdays_per_week(self):
-        birthdays_per_week = defaultdict(list)
-        today = datetime.today().date()
-        monday_of_next_week = today + timedelta(days=(7 - today.weekday()))
-        for name, record in self.data.items():
-            if record.birthday:
-                birthday = datetime.strptime(record.birthday.value, "%d.%m.%Y").date()
-                birthday_this_year = birthday.replace(year=today.year)
-                if birthday_this_year < today:
-                    birthday_this_year = birthday_this_year.replace(year=today.year + 1)
-                delta_days = (birthday_this_year - today).days
-                birthday_weekday = birthday_this_year.weekday()
-                if birthday_weekday >= 5:
-                    birthday_weekday = 0  
-                if delta_days < 7 : 
-                    birthday_weekday_name = (monday_of_next_week + timedelta(days=birthday_weekday)).strftime("%A")
-                    birthdays_per_week[birthday_weekday_name].append(name)
-                    
-        if any(birthdays_per_week.values()):
-            print("Birthdays in the next week:")
-            for day, names in birthdays_per_week.items():
-                if names:
-                    print(f"{day}: {', '.join(names)}")
-        else:
-            print("No birthdays in the next week.")
-
-    def when_birthdays(book):
-        today = datetime.today().date()
-        for record in book.data.values():
-            if record.birthday:
-                birthday = datetime.strptime(record.birthday.value, "%d.%m.%Y").date()
-                next_birthday = birthday.replace(year=today.year)
-                if next_birthday < today:
-                    next_birthday = next_birthday.replace(year=today.year + 1)
-                days_until_birthday = (next_birthday - today).days
-                print(f"{record.name.value}'s birthday is on {record.birthday.value}. It's in {days_until_birthday} days.")
-
-    def remove_contact(self, name):
-        if name in self.data:
-            del self.data[name]
-            print(f"Contact {name} deleted.")
-        else:
-            print("Contact not found.")
+from addressbook import AddressBook, Record, SNAPSHOT_COMPRESSION, convert_to_mapped, load_address_book_from_file
+from instrumentation import METRICS, profile_session
 
-    def remove_birthday(self, name):
-        record = self.find(name)
-        if record:
-            if record.birthday:
-                record.birthday = None
-                print(f"Birthday removed for contact {name}")
-            else:
-                print(f"No birthday set for {name}")
-        else:
-            print(f"Contact {name} not found.")
-
-    def find_notes_by_tag(self, tag):
-        tag_lower = tag.lower()  # Przekształć szukany tag do małych liter
-        found_notes = []
-        for record in self.data.values():
-            for note, tags in record.notes.items():
-                # Przekształć tagi z notatek do małych liter przy porównywaniu
-                if tag_lower in [t.lower() for t in tags]:
-                    found_notes.append((record.name.value, note))
-        return found_notes
-
-    def find_contacts_by_tag(self, tag):
-        tag_lower = tag.lower()  # Przekształć szukany tag do małych liter
-        found_contacts = set()
-        for record in self.data.values():
-            for _, tags in record.notes.items():
-                # Przekształć tagi z notatek do małych liter przy porównywaniu
-                if tag_lower in [t.lower() for t in tags]:
-                    found_contacts.add(record.name.value)
-                    break  # Once a contact with the tag is found, break the loop
-        return list(found_contacts)
-
-
-def load_address_book_from_file(filename):
-    try:
-        with open(filename, 'rb') as file:
-            data = pickle.load(file)
-        address_book = AddressBook()
-        address_book.data = data
-        return address_book
-    except (FileNotFoundError, EOFError):
-        return AddressBook()
 
 def parse_input(user_input):
     try:
@@ -238,288 +21,661 @@ def parse_input(user_input):
     except ValueError:
         return None, None
 
-def intelligent_analysis(command, available_commands):
-    closest_match = get_close_matches(command, available_commands)
-    if closest_match:
-        return closest_match[0]
+Command = namedtuple('Command', 'name handler usage parts rest')
+COMMANDS = {}  # command name -> Command
+
+# Commands that only read the book: they may run on a past state (as_of) and side by side in the server
+READ_COMMANDS = {
+    "phone", "search", "all", "show_birthday", "birthdays", "when_birthdays", "find_notes_by_tag",
+    "find_contacts_by_tag", "find_notes", "who_has_phone", "who_has_email", "duplicates", "export", "birthday_report",
+    "stats", "history", "as_of", "hello",
+}
+
+
+def command(*names, usage, parts=None, rest=False):
+    # parts=None hands the handler the whole argument text, parts=N splits it on ';' into N fields
+    # (at least N with rest=True). A handler returns True to end the session.
+    def register(handler):
+        for name in names:
+            COMMANDS[name] = Command(name, handler, usage, parts, rest)
+        return handler
+    return register
+
+
+def split_arguments(entry, args):
+    text = ' '.join(args)
+    if entry.parts is None:
+        return [text.strip()]
+    if entry.parts == 0:
+        return []
+    fields = [part.strip() for part in text.split(';')]
+    if len(fields) < entry.parts or (len(fields) > entry.parts and not entry.rest):
+        raise ValueError(f"'{entry.name}' takes {entry.parts} fields")
+    return fields
+
+
+def deletion_variants(word, distance=2):
+    variants = {word}
+    frontier = {word}
+    for _ in range(distance):
+        frontier = {variant[:i] + variant[i + 1:] for variant in frontier for i in range(len(variant))}
+        variants |= frontier
+    return variants
+
+
+@lru_cache(maxsize=None)
+def suggestion_index():
+    # Maps every prefix and every 1-2 character deletion of a command to the commands it can come from
+    index = defaultdict(set)
+    for name in COMMANDS:
+        for variant in deletion_variants(name):
+            index[variant].add(name)
+        for end in range(3, len(name)):
+            index[name[:end]].add(name)
+    return index
+
+
+def intelligent_analysis(command):
+    # Two deletions cannot bring a longer token down to a command, so it gets no suggestion. The check comes
+    # before the cache, which would otherwise keep pasted lines as keys, and before the variants, which grow
+    # with the cube of the length
+    if len(command) > max(map(len, COMMANDS)) + 2:
+        return None
+    return suggest_command(command)
+
+
+@lru_cache(maxsize=1024)
+def suggest_command(command):
+    from difflib import SequenceMatcher  # only needed for mistyped commands
+    index = suggestion_index()
+    candidates = set(index.get(command, ()))
+    for variant in deletion_variants(command):
+        candidates |= index.get(variant, set())
+    scored = [(SequenceMatcher(None, command, name).ratio(), name) for name in candidates]
+    scored = [(score, name) for score, name in scored if score >= 0.6]
+    if scored:
+        return max(scored)[1]
     else:
         return None
 
-def main():
-    Globalfilename = 'Myaddressbook3.dat'
-    book = load_address_book_from_file(Globalfilename)
-    print("Welcome to the assistant bot!")
-    
-    ''' 
-        Start assistant commands:
-        comand lists: ["add", "remove_phone", "change_phone", "add_phone", "add_email", "add_address", "phone", "all", "add_birthday", "show_birthday", "birthdays", "add_notes", "find_notes_by_tag", "find_contacts_by_tag", "edit_notes", "delete_notes", "hello", "exit", "close", "delete_contact"]
-    ''' 
-    available_commands = ["add", "remove_phone", "change_phone", "add_phone", "add_email", "add_address", "phone", "all", "add_birthday", "show_birthday", "birthdays", "when_birthdays", "add_notes", "find_notes_by_tag", "find_contacts_by_tag", "edit_notes", "delete_notes", "hello", "exit", "close", "delete_contact"]
 
-    while True:
-        user_input = input("Enter command: ").strip()
+def run_command(book, user_input):
+    with METRICS.timed("dispatch"):
         command, args = parse_input(user_input)
-        
-        closest_command = intelligent_analysis(command, available_commands)
+        entry = COMMANDS.get(command) if command is not None else None
+    if command is None:
+        return False
+    if entry is None:
+        with METRICS.timed("intelligent_analysis"):
+            closest_command = intelligent_analysis(command)
         if closest_command:
-             if command != closest_command:
-                print(f"Did you mean '{closest_command}'?")
-            #continue
-        
-        if command == "add":
-            try:
-                input_str = ' '.join(args)
-                name, phone, email, address = [part.strip() for part in input_str.split(";")]
-                record = Record(name)
-                record.add_phone(phone)
-                record.add_email(email)
-                record.add_address(address)
-                book.add_record(record)
-                print(f"Contact {name} added with phone {phone}, email {email}, and address {address}")
-            except ValueError:
-                print("Invalid command format. Use 'add [name]; [phone]; [email]; [address]'")
-
-        elif command == "delete_contact":
-            try:
-                name = ' '.join(args).strip()
-                book.remove_contact(name)  # This will invoke the remove_contact method correctly
-            except ValueError:
-                print("Invalid command format. Use 'delete_contact [name]'")
-        
-        elif command == "search":
-            try:
-                name = ' '.join(args).strip()
-                found_contacts = book.findname(name)
-                if found_contacts:
-                    print("Found contacts:")
-                    for contact in found_contacts:
-                        print(contact)
-                else:
-                    print("No contacts found matching the search criteria.")
-            except ValueError:
-                print("Invalid command format. Use 'search [name]'")
-
-        elif command == "remove_phone":
-            try:
-                input_str = ' '.join(args)
-                name, phone = [part.strip() for part in input_str.split(";")]
-                record = book.find(name)
-                if record:
-                    record.remove_phone(phone)
-                    print(f"Phone number {phone} removed from contact {name}.")
-                else:
-                    print(f"Contact {name} not found.")
-            except ValueError:
-                print("Invalid command format. Use 'remove_phone [name]; [phone]'")
-
-        elif command == "change_phone":
-            try:
-                input_str = ' '.join(args)
-                name, old_phone, new_phone = [part.strip() for part in input_str.split(";")]
-                record = book.find(name)
-                if record:
-                    record.edit_phone(old_phone, new_phone)
-                    print(f"Phone number changed from {old_phone} to {new_phone} for contact {name}")
-                else:
-                    print(f"Contact {name} not found.")
-            except ValueError:
-                print("Invalid command format. Use 'change_phone [name]; [old_phone]; [new_phone]'")
-
-        elif command == "add_phone":
-            try:
-                input_str = ' '.join(args)
-                name, phone = [part.strip() for part in input_str.split(";")]
-                record = book.find(name)
-                if record:
-                    record.add_phone(phone)
-                    print(f"Phone number {phone} added to contact {name}.")
-                else:
-                    print(f"Contact {name} not found.")
-            except ValueError:
-                print("Invalid command format. Use 'add_phone [name]; [phone]'")
-
-        elif command == "add_email":
-            try:
-                input_str = ' '.join(args)
-                name, email = [part.strip() for part in input_str.split(";")]
-                record = book.find(name)
-                if record:
-                    record.add_email(email)
-                    print(f"Email {email} added to contact {name}.")
-                else:
-                    print(f"Contact {name} not found.")
-            except ValueError:
-                print("Invalid command format. Use 'add_email [name]; [email]'")
-
-        elif command == "add_address":
-            try:
-                input_str = ' '.join(args)
-                name, address = [part.strip() for part in input_str.split(";")]
-                record = book.find(name)
-                if record:
-                    record.add_address(address)
-                    print(f"Address {address} added to contact {name}.")
-                else:
-                    print(f"Contact {name} not found.")
-            except ValueError:
-                print("Invalid command format. Use 'add_address [name]; [address]'")
-
-        elif command == "phone":
-            try:
-                name = ' '.join(args).strip()
-                record = book.find(name)
-                if record:
-                    phone_info = '; '.join(str(p) for p in record.phones)
-                    print(f"Phone numbers for {name}: {phone_info}")
-                else:
-                    print(f"Contact {name} not found.")
-            except ValueError:
-                print("Invalid command format. Use 'phone [name]'")
-
-        elif command == "all":
-            if book.data:
-                print("All contacts:")
-                for record in book.data.values():
-                    print(record)
-            else:
-                print("No contacts in the address book.")
-
-        elif command == "add_birthday":
-            try:
-                input_str = ' '.join(args)
-                name, birthday = [part.strip() for part in input_str.split(";")]
-                record = book.find(name)
-                if record:
-                    record.add_birthday(birthday)
-                    print(f"Birthday {birthday} added to contact {name}.")
-                else:
-                    print(f"Contact {name} not found.")
-            except ValueError:
-                print("Invalid command format. Use 'add_birthday [name]; [birthday]'")
-
-        elif command == "show_birthday":
-            try:
-                name = ' '.join(args).strip()
-                record = book.find(name)
-                if record and record.birthday:
-                    print(f"Birthday for {name}: {record.birthday}")
-                elif record:
-                    print(f"No birthday set for {name}")
-                else:
-                    print(f"Contact {name} not found.")
-            except ValueError:
-                print("Invalid command format. Use 'show_birthday [name]'")
-
-
-        elif command == "birthdays":
-            book.get_birthdays_per_week()
-            
-        elif command == "when_birthdays":
-            book.when_birthdays()
-
-        elif command == "delete_contact":
-            try:
-                name = ' '.join(args).strip()
-                if name in book:
-                    del book[name]
-                    print(f"Contact {name} deleted successfully.")
-                else:
-                    print(f"Contact {name} not found.")
-            except ValueError:
-                print("Invalid command format. Use 'delete_contact [name]'")
-
-        elif command == "add_notes":
-            try:
-                input_str = ' '.join(args)  # Combine all arguments into a single string
-                name, rest = input_str.split(';', 1)  # Split into name and the rest at the first semicolon
-                name = name.strip()
-                note, *tags = [part.strip() for part in rest.split(";")]
-                if name and note:
-                    record = book.find(name)
-                    if record:
-                        tags = [tag.strip() for tag in tags] if tags else []
-                        record.add_notes(note, tags)
-                        print(f"Notes added for contact {name}")
-                    else:
-                        print(f"Contact {name} not found")
-                else:
-                    print("Missing required information for adding notes.")
-            except ValueError:
-                print("Invalid command format. Use 'add_notes [name]; [note]; [tag1; tag2; ...]'")
-
-        elif command == "find_notes_by_tag": 
-            try:
-                tag = args[0]
-                found_notes = book.find_notes_by_tag(tag)
-                if found_notes:
-                    print(f"Notes with tag '{tag}':")
-                    for name, note in found_notes:
-                        print(f"Contact: {name}, Note: {note}")
-                else:
-                    print(f"No notes found with tag '{tag}'")
-            except IndexError:
-                print("Invalid command format. Use 'find_notes_by_tag [tag]'")
-
-        elif command == "find_contacts_by_tag":
-            try:
-                tag = args[0]
-                found_contacts = book.find_contacts_by_tag(tag)
-                if found_contacts:
-                    print(f"Contacts with tag '{tag}':")
-                    for contact in found_contacts:
-                        print(contact)
-                else:
-                    print(f"No contacts found with tag '{tag}'")
-            except IndexError:
-                print("Invalid command format. Use 'find_contacts_by_tag [tag]'")
-
-        elif command == "edit_notes":
-            try:
-                input_str = ' '.join(args)  # Combine all arguments back into a single string
-                name, rest = input_str.split(';', 1)  # Split into name and the rest at the first semicolon
-                name = name.strip()
-                old_note, new_note, *tags = [part.strip() for part in rest.split(";")]
-                if name and old_note and new_note:
-                    record = book.find(name)
-                    if record:
-                        tags = [tag.strip() for tag in tags] if tags else []
-                        record.edit_notes(old_note, new_note, tags)
-                    else:
-                        print(f"Contact {name} not found")
-                else:
-                    print("Missing required information for editing notes.")
-            except ValueError:
-                print("Invalid command format. Use 'edit_notes [name]; [old_note]; [new_note]; [tag1; tag2; ...]'")
-
-        elif command == "delete_notes":
-            try:
-                input_str = ' '.join(args)  # Combine all arguments into a single string
-                name, note = input_str.split(';', 1)  # Attempt to split input into name and note
-                name = name.strip()
-                note = note.strip()
-                if name and note:
-                    record = book.find(name)
-                    if record:
-                        record.delete_notes(note)
-                        print(f"Note '{note}' deleted for contact {name}")
-                    else:
-                        print(f"Contact {name} not found")
-                else:
-                    print("Missing required information for deleting notes.")
-            except ValueError:
-                print("Invalid command format. Use 'delete_notes [name]; [note]'")
-
-        elif command == "hello":
-            print("How can I help you?")
-        
-        elif command in ["close", "exit"]:
-            print("Goodbye!")
-            book.save_to_file(Globalfilename)
-            print("Saving address book and closing the app.")
-            break
+            print(f"Did you mean '{closest_command}'?")
+        print("Invalid command. Please try again")
+        return False
+    try:
+        step = book.recording(entry.name) if isinstance(book, AddressBook) else nullcontext()
+        with METRICS.timed(f"command:{entry.name}"), step:
+            return entry.handler(book, *split_arguments(entry, args))
+    except (ValueError, IndexError):
+        print(f"Invalid command format. Use '{entry.usage}'")
+        return False
+
+
+@command("add", usage="add [name]; [phone]; [email]; [address]", parts=4)
+def add_contact(book, name, phone, email, address):
+    record = Record(name)
+    record.add_phone(phone)
+    record.add_email(email)
+    record.add_address(address)
+    book.add_record(record)
+    print(f"Contact {name} added with phone {phone}, email {email}, and address {address}")
+
+
+@command("delete_contact", usage="delete_contact [name]")
+def delete_contact(book, name):
+    book.remove_contact(name)
+
+
+@command("search", usage="search [name]")
+def search(book, name):
+    found = False
+    for contact in book.iter_findname(name):
+        if not found:
+            print("Found contacts:")
+            found = True
+        print(contact)
+    if not found:
+        print("No contacts found matching the search criteria.")
+
+
+@command("remove_phone", usage="remove_phone [name]; [phone]", parts=2)
+def remove_phone(book, name, phone):
+    record = book.find(name)
+    if record:
+        record.remove_phone(phone)
+        print(f"Phone number {phone} removed from contact {name}.")
+    else:
+        print(f"Contact {name} not found.")
+
+
+@command("change_phone", usage="change_phone [name]; [old_phone]; [new_phone]", parts=3)
+def change_phone(book, name, old_phone, new_phone):
+    record = book.find(name)
+    if record:
+        record.edit_phone(old_phone, new_phone)
+        print(f"Phone number changed from {old_phone} to {new_phone} for contact {name}")
+    else:
+        print(f"Contact {name} not found.")
+
+
+@command("add_phone", usage="add_phone [name]; [phone]", parts=2)
+def add_phone(book, name, phone):
+    record = book.find(name)
+    if record:
+        record.add_phone(phone)
+        print(f"Phone number {phone} added to contact {name}.")
+    else:
+        print(f"Contact {name} not found.")
+
 
+@command("add_email", usage="add_email [name]; [email]", parts=2)
+def add_email(book, name, email):
+    record = book.find(name)
+    if record:
+        record.add_email(email)
+        print(f"Email {email} added to contact {name}.")
+    else:
+        print(f"Contact {name} not found.")
+
+
+@command("add_address", usage="add_address [name]; [address]", parts=2)
+def add_address(book, name, address):
+    record = book.find(name)
+    if record:
+        record.add_address(address)
+        print(f"Address {address} added to contact {name}.")
+    else:
+        print(f"Contact {name} not found.")
+
+
+@command("phone", usage="phone [name]")
+def show_phone(book, name):
+    record = book.find(name)
+    if record:
+        phone_info = '; '.join(str(p) for p in record.phones)
+        print(f"Phone numbers for {name}: {phone_info}")
+    else:
+        print(f"Contact {name} not found.")
+
+
+def parse_listing_options(text):
+    # all [--page N] [--size N] [--after NAME], the name after --after may contain spaces
+    options = {'page': None, 'size': None, 'after': None}
+    tokens = text.split()
+    position = 0
+    while position < len(tokens):
+        option = tokens[position].lstrip('-')
+        if not tokens[position].startswith('--') or option not in options or position + 1 >= len(tokens):
+            raise ValueError(f"Unknown option {tokens[position]}")
+        value = []
+        position += 1
+        while position < len(tokens) and not tokens[position].startswith('--'):
+            value.append(tokens[position])
+            position += 1
+        options[option] = ' '.join(value) if option == 'after' else int(' '.join(value))
+    if options['page'] is not None and options['page'] < 1 or options['size'] is not None and options['size'] < 1:
+        raise ValueError("Page and size start at 1")
+    return options
+
+
+@command("all", usage="all [--page N] [--size N] [--after NAME]")
+def show_all(book, text):
+    options = parse_listing_options(text)
+    if not len(book):
+        print("No contacts in the address book.")
+        return
+    paged = options['page'] is not None or options['size'] is not None or options['after'] is not None
+    size = options['size'] or 50
+    offset = (options['page'] - 1) * size if options['page'] else 0
+    last_name = None
+    shown = 0
+    print("All contacts:")
+    for record in book.iter_sorted_records(offset, size if paged else None, options['after']):
+        print(book.render(record))
+        last_name = record.name.value
+        shown += 1
+    if options['page']:
+        pages = math.ceil(len(book) / size)
+        more = f" Next: all --page {options['page'] + 1} --size {size}" if options['page'] < pages else ""
+        print(f"Page {options['page']} of {pages}.{more}")
+    elif paged and shown == size:
+        print(f"Next: all --size {size} --after {last_name}")
+
+
+@command("add_birthday", usage="add_birthday [name]; [birthday]", parts=2)
+def add_birthday(book, name, birthday):
+    record = book.find(name)
+    if record:
+        record.add_birthday(birthday)
+        print(f"Birthday {birthday} added to contact {name}.")
+    else:
+        print(f"Contact {name} not found.")
+
+
+@command("show_birthday", usage="show_birthday [name]")
+def show_birthday(book, name):
+    record = book.find(name)
+    if record and record.birthday:
+        print(f"Birthday for {name}: {record.birthday}")
+    elif record:
+        print(f"No birthday set for {name}")
+    else:
+        print(f"Contact {name} not found.")
+
+
+@command("birthdays", usage="birthdays", parts=0)
+def birthdays(book):
+    book.get_birthdays_per_week()
+
+
+@command("when_birthdays", usage="when_birthdays", parts=0)
+def when_birthdays(book):
+    book.when_birthdays()
+
+
+@command("add_notes", usage="add_notes [name]; [note]; [tag1; tag2; ...]", parts=2, rest=True)
+def add_notes(book, name, note, *tags):
+    if name and note:
+        record = book.find(name)
+        if record:
+            record.add_notes(note, list(tags))
+            print(f"Notes added for contact {name}")
         else:
-            print("Invalid command. Please try again")
+            print(f"Contact {name} not found")
+    else:
+        print("Missing required information for adding notes.")
+
+
+@command("find_notes_by_tag", usage="find_notes_by_tag [tag]")
+def find_notes_by_tag(book, text):
+    tag = text.split()[0]
+    found_notes = book.find_notes_by_tag(tag)
+    if found_notes:
+        print(f"Notes with tag '{tag}':")
+        for name, note in found_notes:
+            print(f"Contact: {name}, Note: {note}")
+    else:
+        print(f"No notes found with tag '{tag}'")
+
+
+@command("find_contacts_by_tag", usage="find_contacts_by_tag [tag]")
+def find_contacts_by_tag(book, text):
+    tag = text.split()[0]
+    found_contacts = book.find_contacts_by_tag(tag)
+    if found_contacts:
+        print(f"Contacts with tag '{tag}':")
+        for contact in found_contacts:
+            print(contact)
+    else:
+        print(f"No contacts found with tag '{tag}'")
+
+
+@command("edit_notes", usage="edit_notes [name]; [old_note]; [new_note]; [tag1; tag2; ...]", parts=3, rest=True)
+def edit_notes(book, name, old_note, new_note, *tags):
+    if name and old_note and new_note:
+        record = book.find(name)
+        if record:
+            record.edit_notes(old_note, new_note, list(tags))
+        else:
+            print(f"Contact {name} not found")
+    else:
+        print("Missing required information for editing notes.")
+
+
+@command("delete_notes", usage="delete_notes [name]; [note]", parts=2, rest=True)
+def delete_notes(book, name, *note_parts):
+    note = ';'.join(note_parts).strip()  # the note itself may contain ';'
+    if name and note:
+        record = book.find(name)
+        if record:
+            record.delete_notes(note)
+            print(f"Note '{note}' deleted for contact {name}")
+        else:
+            print(f"Contact {name} not found")
+    else:
+        print("Missing required information for deleting notes.")
+
+
+@command("import", usage="import [file.csv|file.jsonl]")
+def import_contacts(book, filename):
+    try:
+        imported, rejected = book.import_contacts(filename)
+        print(f"Imported {imported} contacts from {filename}.")
+        if rejected:
+            print(f"Rejected {rejected} rows, see {filename}.rejected.csv")
+    except (OSError, ValueError) as error:
+        print(f"Import failed: {error}. Use 'import [file.csv|file.jsonl]'")
+
+
+@command("export", usage="export [file.csv|file.jsonl]")
+def export_contacts(book, filename):
+    try:
+        exported = book.export_contacts(filename)
+        print(f"Exported {exported} contacts to {filename}.")
+    except (OSError, ValueError) as error:
+        print(f"Export failed: {error}. Use 'export [file.csv|file.jsonl]'")
+
+
+@command("find_notes", usage="find_notes [word] [word] [prefix*] ...")
+def find_notes(book, query):
+    if not query.split():
+        raise ValueError("find_notes needs at least one word")
+    found_notes = book.find_notes(query, limit=50)
+    if found_notes:
+        print(f"Notes matching '{query}':")
+        for name, note, score in found_notes:
+            print(f"Contact: {name}, Note: {note} (score {score:.2f})")
+    else:
+        print(f"No notes found matching '{query}'")
+
+
+@command("who_has_phone", usage="who_has_phone [phone]")
+def who_has_phone(book, phone):
+    names = book.who_has_phone(phone)
+    if names:
+        print(f"Phone {phone} belongs to: {', '.join(names)}")
+    else:
+        print(f"No contact has phone {phone}")
+
+
+@command("who_has_email", usage="who_has_email [email]")
+def who_has_email(book, email):
+    names = book.who_has_email(email)
+    if names:
+        print(f"Email {email} belongs to: {', '.join(names)}")
+    else:
+        print(f"No contact has email {email}")
+
+
+@command("duplicates", usage="duplicates", parts=0)
+def duplicates(book):
+    groups = book.duplicate_contacts()
+    if groups:
+        print("Contacts sharing a phone or email:")
+        for names, values in groups:
+            print(f"{', '.join(names)} (shared: {', '.join(values)})")
+    else:
+        print("No duplicate contacts found.")
+
+
+@command("birthday_report", usage="birthday_report [months|ages|round|week|when]")
+def birthday_report(book, text):
+    from analytics import BIRTHDAY_REPORTS, BirthdayColumns
+    reports = text.split() or ['months', 'ages', 'round']
+    for report in reports:
+        if report not in BIRTHDAY_REPORTS:
+            raise ValueError(f"Unknown report '{report}'")
+    try:
+        columns = BirthdayColumns.of(book)
+    except ImportError as error:
+        print(error)
+        return
+    for report in reports:
+        BIRTHDAY_REPORTS[report](columns)
+
+
+@command("stats", usage="stats [reset]")
+def stats(book, text):
+    if text == "reset":
+        METRICS.reset()
+        print("Statistics cleared.")
+    elif text:
+        raise ValueError(text)
+    else:
+        METRICS.report()
+
+
+def describe_step(step):
+    changes = len(step.changes)
+    return (f"{step.label or 'change'} at {datetime.fromtimestamp(step.time):%Y-%m-%d %H:%M:%S} "
+            f"({changes} contact{'s' if changes != 1 else ''} changed)")
+
+
+def replay(book, direction):
+    if not isinstance(book, AddressBook):
+        print("Undo and redo are not available for this address book.")
+        return
+    step = book.undo() if direction == "undo" else book.redo()
+    if step is None:
+        print(f"Nothing to {direction}.")
+    else:
+        print(f"{'Undone' if direction == 'undo' else 'Redone'}: {describe_step(step)}")
+
+
+@command("undo", usage="undo", parts=0)
+def undo(book):
+    replay(book, "undo")
+
+
+@command("redo", usage="redo", parts=0)
+def redo(book):
+    replay(book, "redo")
+
+
+@command("history", usage="history [count]")
+def history(book, text):
+    count = int(text) if text else 10
+    steps = book.history_steps() if isinstance(book, AddressBook) else []
+    if not steps:
+        print("No changes recorded yet.")
+        return
+    for step in steps[-count:]:
+        print(describe_step(step))
+
+
+def parse_moment(text):
+    # "2024-05-10 14:30", "2024-05-10T14:30:15" or a time of today such as "14:30"
+    try:
+        return datetime.fromisoformat(text).timestamp()
+    except ValueError:
+        pass
+    for clock_format in ("%H:%M:%S", "%H:%M"):
+        try:
+            clock = datetime.strptime(text, clock_format).time()
+        except ValueError:
+            continue
+        return datetime.combine(date.today(), clock).timestamp()
+    raise ValueError(f"Unknown time '{text}'")
+
+
+@command("as_of", usage="as_of [YYYY-MM-DD HH:MM or HH:MM]; [read-only command, default all]", parts=1, rest=True)
+def as_of(book, moment, *command_parts):
+    command_text = '; '.join(command_parts).strip() or "all"
+    if parse_input(command_text)[0] not in READ_COMMANDS - {"as_of"}:
+        print("Only commands that read the address book can run on a past state.")
+        return
+    if not isinstance(book, AddressBook):
+        print("History is not available for this address book.")
+        return
+    try:
+        view = book.as_of(parse_moment(moment))
+    except ValueError as error:
+        print(error)
+        return
+    run_command(view, command_text)
+
+
+@command("hello", usage="hello", parts=0)
+def hello(book):
+    print("How can I help you?")
+
+
+@command("close", "exit", usage="exit", parts=0)
+def close(book):
+    print("Goodbye!")
+    snapshot = book.compact()
+    book.close_journal()
+    print("Saving address book and closing the app.")
+    if snapshot is not None:
+        print(f"Saved {snapshot.records} contacts: {snapshot.bytes / 1024:.1f} KiB {snapshot.compression} "
+              f"({snapshot.raw_bytes / 1024:.1f} KiB uncompressed) in {snapshot.seconds * 1000:.0f} ms.")
+    return True
+
+
+def run_batch(book, lines, save_every=0, output=None):
+    # Runs commands without prompts, output is written in large chunks instead of line by line
+    output = output or sys.stdout
+    buffer = io.StringIO()
+    timings = defaultdict(lambda: [0, 0.0, 0.0])  # command -> [calls, total seconds, slowest call]
+    executed = 0
+    finished = False
+    started = time.perf_counter()
+    with redirect_stdout(buffer):
+        for line in lines:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            command_name = parse_input(line)[0]
+            if command_name not in COMMANDS:
+                command_name = 'invalid'
+            command_started = time.perf_counter()
+            finished = run_command(book, line)
+            elapsed = time.perf_counter() - command_started
+            timing = timings[command_name]
+            timing[0] += 1
+            timing[1] += elapsed
+            timing[2] = max(timing[2], elapsed)
+            executed += 1
+            if buffer.tell() > 1 << 16:
+                output.write(buffer.getvalue())
+                buffer.seek(0)
+                buffer.truncate()
+            if finished:
+                break
+            if save_every and executed % save_every == 0:
+                book.compact()
+        if not finished:
+            book.compact()
+            book.close_journal()
+    output.write(buffer.getvalue())
+    output.flush()
+    print_batch_report(executed, time.perf_counter() - started, timings)
+    return executed
+
+
+def print_batch_report(executed, elapsed, timings, top=5):
+    rate = executed / elapsed if elapsed else 0.0
+    print(f"Ran {executed} commands in {elapsed:.2f}s ({rate:.0f} commands/s)", file=sys.stderr)
+    slowest = sorted(timings.items(), key=lambda item: item[1][1], reverse=True)[:top]
+    if slowest:
+        print("Slowest command types (total / average / slowest call):", file=sys.stderr)
+    for name, (calls, total, worst) in slowest:
+        print(f"  {name}: {total * 1000:.1f} ms / {total / calls * 1000:.3f} ms / {worst * 1000:.3f} ms"
+              f" over {calls} calls", file=sys.stderr)
+
+
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(description="Address book assistant")
+    parser.add_argument('--file', default='Myaddressbook3.dat', help="address book file")
+    parser.add_argument('--batch', metavar='FILE',
+                        help="run commands from FILE ('-' for stdin) instead of prompting")
+    parser.add_argument('--save-every', type=int, default=0, metavar='N',
+                        help="in batch mode save the book every N commands as well as at the end")
+    parser.add_argument('--shards', type=int, default=0, metavar='N',
+                        help="split the book over N worker processes (files <file>.shardXofN)")
+    parser.add_argument('--sqlite', action='store_true', help="keep the book in the SQLite database --file")
+    parser.add_argument('--compression', choices=sorted(SNAPSHOT_COMPRESSION), default='zlib',
+                        help="how snapshots of the address book are compressed")
+    parser.add_argument('--interactive', action='store_true',
+                        help="prompt for commands even when stdin is not a terminal")
+    parser.add_argument('--profile', metavar='FILE',
+                        help="profile the session with cProfile and tracemalloc, write the results to FILE")
+    parser.add_argument('--convert', nargs=2, metavar=('SOURCE', 'TARGET'),
+                        help="convert a pickled address book into the memory-mapped format")
+    parser.add_argument('--migrate', nargs=2, metavar=('SOURCE', 'DATABASE'),
+                        help="copy a pickled address book into a SQLite database")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    arguments = parse_arguments(argv)
+    if arguments.convert:
+        convert_to_mapped(*arguments.convert)
+        return
+    if arguments.migrate:
+        from sqlite_backend import migrate_to_sqlite
+        migrate_to_sqlite(*arguments.migrate)
+        return
+    Globalfilename = arguments.file
+    if arguments.shards:
+        from sharding import ShardedAddressBook
+        book = ShardedAddressBook(Globalfilename, arguments.shards)
+    elif arguments.sqlite:
+        from sqlite_backend import SQLiteAddressBook
+        book = SQLiteAddressBook(Globalfilename)
+    else:
+        interactive = batch_source(arguments) is None
+
+        def load():
+            book = load_address_book_from_file(Globalfilename, journal=True, compression=arguments.compression)
+            if interactive:  # batches have nobody to undo for them, the history would only slow them down
+                book.enable_history()
+            return book
+        book = BackgroundLoad(load)
+
+    METRICS.enabled = True
+    with profile_session(arguments.profile) if arguments.profile else nullcontext():
+        run_session(book, arguments)
+
+
+class BackgroundLoad(threading.Thread):
+    # Loads the book while the prompt is already on screen; result() waits until it is there
+    def __init__(self, load):
+        super().__init__(daemon=True)
+        self._load = load
+        self._book = None
+        self._error = None
+        self.start()
+
+    def run(self):
+        try:
+            self._book = self._load()
+        except BaseException as error:
+            self._error = error
+
+    def result(self):
+        self.join()
+        if self._error is not None:
+            raise self._error
+        return self._book
+
+
+def batch_source(arguments):
+    # The script to run, '-' for commands piped in on stdin, None for an interactive session
+    if arguments.batch is None and not arguments.interactive and not sys.stdin.isatty():
+        return '-'
+    return arguments.batch
+
+
+def run_session(book, arguments):
+    batch = batch_source(arguments)
+    if batch is not None:
+        if isinstance(book, BackgroundLoad):
+            book = book.result()
+        if batch == '-':
+            run_batch(book, sys.stdin, arguments.save_every)
+        else:
+            with open(batch, encoding='utf-8') as script:
+                run_batch(book, script, arguments.save_every)
+        return
+
+    print("Welcome to the assistant bot!")
+    while True:
+        user_input = input("Enter command: ").strip()
+        if isinstance(book, BackgroundLoad):
+            book = book.result()  # only the first command can find the book still loading
+        if run_command(book, user_input):
+            break
 
 if __name__ == "__main__":
     main()
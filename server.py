@@ -0,0 +1,232 @@
+import argparse
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+import io
+import random
+import statistics
+import sys
+import threading
+import time
+
+from addressbook import load_address_book_from_file
+from instrumentation import METRICS
+from main import COMMANDS, READ_COMMANDS, parse_input, run_command
+
+
+class ThreadOutput(threading.local):
+    # Stands in for sys.stdout so every worker thread collects the prints of its own command
+    def __init__(self):
+        self.buffer = None
+
+
+class CapturedStdout(io.TextIOBase):
+    def __init__(self, stream, output):
+        self.stream = stream
+        self.output = output
+
+    def write(self, text):
+        buffer = self.output.buffer
+        return (self.stream if buffer is None else buffer).write(text)
+
+    def flush(self):
+        if self.output.buffer is None:
+            self.stream.flush()
+
+
+class ReadWriteLock:
+    # Many readers or one writer; waiting writers keep new readers out so they are not starved
+    def __init__(self):
+        self._condition = asyncio.Condition()
+        self._readers = 0
+        self._writer = False
+        self._waiting_writers = 0
+
+    @asynccontextmanager
+    async def reading(self):
+        async with self._condition:
+            await self._condition.wait_for(lambda: not self._writer and not self._waiting_writers)
+            self._readers += 1
+        try:
+            yield
+        finally:
+            async with self._condition:
+                self._readers -= 1
+                self._condition.notify_all()
+
+    @asynccontextmanager
+    async def writing(self):
+        async with self._condition:
+            self._waiting_writers += 1
+            await self._condition.wait_for(lambda: not self._writer and not self._readers)
+            self._waiting_writers -= 1
+            self._writer = True
+        try:
+            yield
+        finally:
+            async with self._condition:
+                self._writer = False
+                self._condition.notify_all()
+
+
+class AddressBookServer:
+    # Line protocol: the client sends one command per line, the answer is "OK <bytes>\n" and the output
+    def __init__(self, filename, workers=8, save_interval=30.0):
+        self.book = load_address_book_from_file(filename, journal=True)
+        self.book.enable_history()
+        self.lock = ReadWriteLock()
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.save_interval = save_interval
+        self.output = ThreadOutput()
+        METRICS.enabled = True
+
+    def _run(self, text):
+        buffer = io.StringIO()
+        self.output.buffer = buffer
+        try:
+            run_command(self.book, text)
+        except Exception as error:  # one broken command must not take the server down
+            print(f"Error: {error}")
+        finally:
+            self.output.buffer = None
+        return buffer.getvalue()
+
+    async def execute(self, text):
+        loop = asyncio.get_running_loop()
+        command_name = parse_input(text)[0]
+        # Unknown commands only print a suggestion, so they count as reads too
+        if command_name in READ_COMMANDS or command_name not in COMMANDS:
+            access = self.lock.reading()
+        else:
+            access = self.lock.writing()
+        async with access:
+            return await loop.run_in_executor(self.executor, self._run, text)
+
+    async def handle_client(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                text = line.decode('utf-8', errors='replace').strip()
+                if parse_input(text)[0] in ("exit", "close"):
+                    await self._respond(writer, "Goodbye!\n")
+                    break
+                await self._respond(writer, await self.execute(text) if text else "")
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def _respond(writer, output):
+        data = output.encode('utf-8')
+        writer.write(f"OK {len(data)}\n".encode('ascii') + data)
+        await writer.drain()
+
+    async def save_periodically(self):
+        # Compaction copies the book under the journal lock and writes it from a worker thread. Commands keep
+        # changing the indexes meanwhile, so they are only saved by the compaction at shutdown
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.save_interval)
+            if self.book._journal_entries:  # an idle server has nothing to fold, the snapshot stays as it is
+                await loop.run_in_executor(None, self.book.compact, False)
+
+    async def serve(self, host='127.0.0.1', port=8765, unix_path=None):
+        sys.stdout = CapturedStdout(sys.stdout, self.output)
+        if unix_path:
+            server = await asyncio.start_unix_server(self.handle_client, path=unix_path)
+        else:
+            server = await asyncio.start_server(self.handle_client, host, port)
+        saver = asyncio.create_task(self.save_periodically())
+        where = unix_path or f"{host}:{port}"
+        print(f"Address book server listening on {where}", file=sys.stderr)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            saver.cancel()
+            self.executor.shutdown(wait=True)
+            self.book.compact()
+            self.book.close_journal()
+            sys.stdout = sys.stdout.stream
+
+
+async def open_client(host, port, unix_path=None):
+    if unix_path:
+        return await asyncio.open_unix_connection(unix_path)
+    return await asyncio.open_connection(host, port)
+
+
+async def send_command(reader, writer, text):
+    writer.write(text.encode('utf-8') + b'\n')
+    await writer.drain()
+    header = await reader.readline()
+    if not header.startswith(b'OK '):
+        raise ConnectionError("Server closed the connection")
+    return (await reader.readexactly(int(header[3:]))).decode('utf-8')
+
+
+async def load_client(number, requests, write_ratio, latencies, host, port, unix_path):
+    reader, writer = await open_client(host, port, unix_path)
+    rng = random.Random(number)
+    name = f"Load Client {number}"
+    await send_command(reader, writer, f"add {name}; {number:010d}; load{number}@example.com; Loadtown")
+    for request in range(requests):
+        if rng.random() < write_ratio:
+            text = rng.choice([f"add_phone {name}; {rng.randrange(10 ** 10):010d}",
+                               f"add_notes {name}; load note {request}; load; client{number}"])
+        else:
+            text = rng.choice([f"phone {name}", "search Load Cli", "find_notes_by_tag load",
+                               f"who_has_phone {number:010d}", "find_notes load"])
+        started = time.perf_counter()
+        await send_command(reader, writer, text)
+        latencies.append(time.perf_counter() - started)
+    await send_command(reader, writer, f"delete_contact {name}")
+    writer.write(b"exit\n")
+    await writer.drain()
+    writer.close()
+
+
+async def generate_load(clients=10, requests=200, write_ratio=0.2, host='127.0.0.1', port=8765, unix_path=None):
+    latencies = []
+    started = time.perf_counter()
+    await asyncio.gather(*(load_client(number, requests, write_ratio, latencies, host, port, unix_path)
+                           for number in range(clients)))
+    elapsed = time.perf_counter() - started
+    percentiles = statistics.quantiles(latencies, n=100)
+    print(f"{len(latencies)} requests from {clients} clients in {elapsed:.2f}s "
+          f"({len(latencies) / elapsed:.0f} requests/s)")
+    print(f"latency p50 {percentiles[49] * 1000:.2f} ms, p95 {percentiles[94] * 1000:.2f} ms, "
+          f"p99 {percentiles[98] * 1000:.2f} ms, max {max(latencies) * 1000:.2f} ms")
+    return percentiles
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve an address book to many clients")
+    parser.add_argument('mode', choices=['serve', 'loadgen'])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--unix', metavar='PATH', help="listen on / connect to a Unix socket instead of TCP")
+    parser.add_argument('--file', default='Myaddressbook3.dat', help="address book file (serve)")
+    parser.add_argument('--workers', type=int, default=8, help="threads running commands (serve)")
+    parser.add_argument('--save-interval', type=float, default=30.0, help="seconds between saves (serve)")
+    parser.add_argument('--clients', type=int, default=10, help="concurrent connections (loadgen)")
+    parser.add_argument('--requests', type=int, default=200, help="requests per client (loadgen)")
+    parser.add_argument('--write-ratio', type=float, default=0.2, help="share of mutating requests (loadgen)")
+    arguments = parser.parse_args(argv)
+
+    if arguments.mode == 'serve':
+        server = AddressBookServer(arguments.file, arguments.workers, arguments.save_interval)
+        try:
+            asyncio.run(server.serve(arguments.host, arguments.port, arguments.unix))
+        except KeyboardInterrupt:
+            pass
+    else:
+        asyncio.run(generate_load(arguments.clients, arguments.requests, arguments.write_ratio,
+                                  arguments.host, arguments.port, arguments.unix))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,239 @@
+from contextlib import redirect_stdout
+import heapq
+import io
+from itertools import islice
+import multiprocessing
+import os
+import sys
+from types import GeneratorType
+import zlib
+
+from addressbook import AddressBook, group_shared_values, load_address_book_from_file
+
+
+def shard_worker(connection, filename):
+    # Owns one slice of the book; answers (operation, arguments) messages until it is told to stop
+    book = load_address_book_from_file(filename, journal=True)
+    while True:
+        operation, arguments = connection.recv()
+        output = io.StringIO()
+        try:
+            with redirect_stdout(output):
+                result = SHARD_OPERATIONS[operation](book, *arguments)
+            if isinstance(result, GeneratorType):
+                result = list(result)
+            connection.send((result, output.getvalue(), None))
+        except Exception as error:
+            connection.send((None, output.getvalue(), error))
+        if operation == 'stop':
+            break
+    connection.close()
+
+
+def call_book(book, method, arguments):
+    return getattr(book, method)(*arguments)
+
+
+def call_record(book, name, method, arguments):
+    record = book.find(name)
+    if record is None:
+        raise KeyError(name)
+    return getattr(record, method)(*arguments), record
+
+
+def index_postings(book, attribute):
+    return {key: list(members) for key, members in book._record_index(attribute).items()}
+
+
+def stop(book):
+    book.compact()
+    book.close_journal()
+
+
+SHARD_OPERATIONS = {
+    'call': call_book,
+    'record': call_record,
+    'index': index_postings,
+    'stop': stop,
+}
+
+
+class RemoteRecord:
+    # Read access goes to a local copy, the Record methods that change it run in the owning shard
+    MUTATORS = {'add_notes', 'add_birthday', 'add_phone', 'add_email', 'add_address', 'edit_phone',
+                'remove_phone', 'edit_notes', 'delete_notes'}
+
+    def __init__(self, book, record):
+        self._book = book
+        self._record = record
+
+    def __getattr__(self, attribute):
+        if attribute not in self.MUTATORS:
+            return getattr(self._record, attribute)
+
+        def forward(*arguments):
+            name = self._record.name.value
+            result, self._record = self._book._request(self._book._shard(name), 'record', name, attribute, arguments)
+            return result
+        return forward
+
+    def __str__(self):
+        return str(self._record)
+
+
+class ShardedAddressBook:
+    # Hash-partitions contacts by name over worker processes, each with its own journaled file.
+    # Lookups by name go to one shard, scans are sent to every shard at once and merged here.
+    def __init__(self, filename='Myaddressbook3.dat', shards=None):
+        shards = shards or os.cpu_count() or 1
+        base, extension = os.path.splitext(filename)
+        self.filenames = [f"{base}.shard{number}of{shards}{extension}" for number in range(shards)]
+        self._connections = []
+        self._processes = []
+        for shard_filename in self.filenames:
+            parent_end, child_end = multiprocessing.Pipe()
+            process = multiprocessing.Process(target=shard_worker, args=(child_end, shard_filename), daemon=True)
+            process.start()
+            child_end.close()
+            self._connections.append(parent_end)
+            self._processes.append(process)
+
+    def _shard(self, name):
+        # crc32 rather than hash() so a name lands in the same shard in every run
+        return zlib.crc32(name.encode('utf-8')) % len(self._connections)
+
+    def _receive(self, shard):
+        result, output, error = self._connections[shard].recv()
+        if output:
+            sys.stdout.write(output)
+        if error is not None:
+            raise error
+        return result
+
+    def _request(self, shard, operation, *arguments):
+        self._connections[shard].send((operation, arguments))
+        return self._receive(shard)
+
+    def _scatter(self, operation, *arguments):
+        for connection in self._connections:
+            connection.send((operation, arguments))
+        return [self._receive(shard) for shard in range(len(self._connections))]
+
+    def _call(self, name, method, *arguments):
+        return self._request(self._shard(name), 'call', method, arguments)
+
+    def _call_all(self, method, *arguments):
+        return self._scatter('call', method, arguments)
+
+    def __len__(self):
+        return sum(self._call_all('__len__'))
+
+    def __contains__(self, name):
+        return self._call(name, '__contains__', name)
+
+    def add_record(self, record):
+        self._call(record.name.value, 'add_record', record)
+
+    def add_records(self, records):
+        per_shard = [[] for _ in self._connections]
+        for record in records:
+            per_shard[self._shard(record.name.value)].append(record)
+        for shard, shard_records in enumerate(per_shard):
+            if shard_records:
+                self._connections[shard].send(('call', ('add_records', (shard_records,))))
+        return sum(self._receive(shard) for shard, shard_records in enumerate(per_shard) if shard_records)
+
+    def find(self, name):
+        record = self._call(name, 'find', name)
+        return RemoteRecord(self, record) if record is not None else None
+
+    def findname(self, name):
+        found = [record for records in self._call_all('findname', name) if records for record in records]
+        found.sort(key=lambda record: (record.name.value.casefold(), record.name.value))
+        return found or None
+
+    def iter_findname(self, name, offset=0, limit=None):
+        stop = None if limit is None else offset + limit
+        yield from islice(self.findname(name) or (), offset, stop)
+
+    def remove_contact(self, name):
+        self._call(name, 'remove_contact', name)
+
+    def remove_birthday(self, name):
+        self._call(name, 'remove_birthday', name)
+
+    def find_notes_by_tag(self, tag):
+        return [hit for hits in self._call_all('find_notes_by_tag', tag) for hit in hits]
+
+    def find_contacts_by_tag(self, tag):
+        return [name for names in self._call_all('find_contacts_by_tag', tag) for name in names]
+
+    def find_notes(self, query, limit=None):
+        found = [hit for hits in self._call_all('find_notes', query, limit) for hit in hits]
+        found.sort(key=lambda hit: (-hit[2], hit[0], hit[1]))
+        return found[:limit]
+
+    def who_has_phone(self, phone):
+        return [name for names in self._call_all('who_has_phone', phone) for name in names]
+
+    def who_has_email(self, email):
+        return [name for names in self._call_all('who_has_email', email) for name in names]
+
+    def _merged_index(self, attribute):
+        merged = {}
+        for postings in self._scatter('index', attribute):
+            for key, names in postings.items():
+                merged.setdefault(key, []).extend(names)
+        return merged
+
+    def duplicate_contacts(self):
+        # Two contacts sharing a phone usually live in different shards, so the postings are merged here
+        return group_shared_values((self._merged_index('_phones'), self._merged_index('_emails')))
+
+    def upcoming_birthdays(self, days=7, today=None):
+        upcoming = [birthday for birthdays in self._call_all('upcoming_birthdays', days, today)
+                    for birthday in birthdays]
+        upcoming.sort(key=lambda birthday: (birthday.days, birthday.name))
+        return upcoming
+
+    def iter_birthdays(self):
+        for pairs in self._call_all('iter_birthdays'):
+            yield from pairs
+
+    # The reports only need upcoming_birthdays(), so AddressBook's own versions work over the shards
+    get_birthdays_per_week = AddressBook.get_birthdays_per_week
+    when_birthdays = AddressBook.when_birthdays
+    export_contacts = AddressBook.export_contacts
+    import_contacts = AddressBook.import_contacts
+
+    def iter_records(self):
+        for records in self._call_all('iter_records'):
+            yield from records
+
+    def iter_sorted_records(self, offset=0, limit=None, after=None):
+        # Every shard returns its first offset + limit records, a k-way merge picks the page
+        wanted = None if limit is None else offset + limit
+        pages = self._call_all('iter_sorted_records', 0, wanted, after)
+        merged = heapq.merge(*pages, key=lambda record: (record.name.value.casefold(), record.name.value))
+        yield from islice(merged, offset, wanted)
+
+    def render(self, record):
+        return str(record)
+
+    def save_to_file(self, filename=None):
+        # Every shard folds its journal into its own file
+        self.compact()
+
+    def compact(self):
+        self._call_all('compact')
+
+    def close_journal(self):
+        if not self._connections:
+            return
+        self._scatter('stop')
+        for connection in self._connections:
+            connection.close()
+        for process in self._processes:
+            process.join()
+        self._connections = []
+        self._processes = []
@@ -0,0 +1,380 @@
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import date
+import os
+import sqlite3
+import threading
+
+from addressbook import (AddressBook, Address, Birthday, Email, Name, Phone, Record, UpcomingBirthday,
+                         birthday_calendar, group_shared_values, normalise_phone, read_address_book, tokenize)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS records (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE,
+    folded TEXT NOT NULL,
+    birthday INTEGER,  -- ordinal day
+    birthday_key INTEGER  -- month * 100 + day
+);
+CREATE INDEX IF NOT EXISTS records_folded ON records (folded, name);
+CREATE INDEX IF NOT EXISTS records_birthday ON records (birthday_key);
+CREATE TABLE IF NOT EXISTS phones (
+    record_id INTEGER NOT NULL REFERENCES records (id) ON DELETE CASCADE,
+    phone TEXT NOT NULL,
+    digits TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS phones_record ON phones (record_id);
+CREATE INDEX IF NOT EXISTS phones_digits ON phones (digits);
+CREATE TABLE IF NOT EXISTS emails (
+    record_id INTEGER NOT NULL REFERENCES records (id) ON DELETE CASCADE,
+    email TEXT NOT NULL,
+    folded TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS emails_record ON emails (record_id);
+CREATE INDEX IF NOT EXISTS emails_folded ON emails (folded);
+CREATE TABLE IF NOT EXISTS addresses (
+    record_id INTEGER NOT NULL REFERENCES records (id) ON DELETE CASCADE,
+    address TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS addresses_record ON addresses (record_id);
+CREATE TABLE IF NOT EXISTS notes (
+    id INTEGER PRIMARY KEY,
+    record_id INTEGER NOT NULL REFERENCES records (id) ON DELETE CASCADE,
+    note TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS notes_record ON notes (record_id);
+CREATE TABLE IF NOT EXISTS tags (
+    note_id INTEGER NOT NULL REFERENCES notes (id) ON DELETE CASCADE,
+    tag TEXT NOT NULL,
+    folded TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS tags_note ON tags (note_id);
+CREATE INDEX IF NOT EXISTS tags_folded ON tags (folded);
+"""
+
+# Trigram index over the folded names and a word index over the notes, kept in step by triggers
+FULL_TEXT_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS name_grams USING fts5 (folded, content='records', content_rowid='id',
+                                                           tokenize='trigram');
+CREATE TRIGGER IF NOT EXISTS records_insert AFTER INSERT ON records BEGIN
+    INSERT INTO name_grams (rowid, folded) VALUES (new.id, new.folded);
+END;
+CREATE TRIGGER IF NOT EXISTS records_delete AFTER DELETE ON records BEGIN
+    INSERT INTO name_grams (name_grams, rowid, folded) VALUES ('delete', old.id, old.folded);
+END;
+CREATE VIRTUAL TABLE IF NOT EXISTS note_words USING fts5 (note, content='notes', content_rowid='id');
+CREATE TRIGGER IF NOT EXISTS notes_insert AFTER INSERT ON notes BEGIN
+    INSERT INTO note_words (rowid, note) VALUES (new.id, new.note);
+END;
+CREATE TRIGGER IF NOT EXISTS notes_delete AFTER DELETE ON notes BEGIN
+    INSERT INTO note_words (note_words, rowid, note) VALUES ('delete', old.id, old.note);
+END;
+"""
+
+CHUNK = 500  # ids per IN (...) list, well below SQLite's limit on query parameters
+
+
+def make_field(cls, value):
+    # Values in the database were validated when they were added, so the checks in __init__ are skipped
+    field = cls.__new__(cls)
+    field.value = value
+    return field
+
+
+class SQLiteAddressBook:
+    # AddressBook kept in normalised SQLite tables instead of memory. Records handed out are built from
+    # the rows on every lookup and write themselves back through the Record change hooks.
+    def __init__(self, filename='Myaddressbook3.db', batch_size=1000):
+        self.filename = filename
+        self.batch_size = batch_size
+        self._lock = threading.RLock()  # the server runs commands from several threads
+        self._change_lock = self._lock  # a record change is written back in one transaction
+        self._connection = sqlite3.connect(filename, isolation_level=None, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode = WAL")
+        self._connection.execute("PRAGMA synchronous = NORMAL")
+        self._connection.execute("PRAGMA foreign_keys = ON")
+        self._connection.executescript(SCHEMA)
+        try:
+            self._connection.executescript(FULL_TEXT_SCHEMA)
+            self._full_text = True
+        except sqlite3.OperationalError:  # SQLite built without FTS5, searches fall back to scans
+            self._full_text = False
+
+    @contextmanager
+    def _transaction(self):
+        with self._lock:
+            self._connection.execute("BEGIN")
+            try:
+                yield self._connection
+            except BaseException:
+                self._connection.execute("ROLLBACK")
+                raise
+            self._connection.execute("COMMIT")
+
+    def _query(self, sql, parameters=()):
+        with self._lock:
+            return self._connection.execute(sql, parameters).fetchall()
+
+    def _record_will_change(self, record):
+        pass
+
+    def _record_changed(self, record):
+        with self._transaction() as connection:
+            self._write_record(connection, record)
+
+    def _write_record(self, connection, record):
+        name = record.name.value
+        birthday = record.birthday.date if record.birthday else None
+        connection.execute(
+            "INSERT INTO records (name, folded, birthday, birthday_key) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (name) DO UPDATE SET birthday = excluded.birthday, birthday_key = excluded.birthday_key",
+            (name, name.casefold(), birthday and birthday.toordinal(),
+             birthday and birthday.month * 100 + birthday.day))
+        record_id, = connection.execute("SELECT id FROM records WHERE name = ?", (name,)).fetchone()
+        for table in ('phones', 'emails', 'addresses', 'notes'):
+            connection.execute(f"DELETE FROM {table} WHERE record_id = ?", (record_id,))
+        connection.executemany("INSERT INTO phones VALUES (?, ?, ?)",
+                               [(record_id, phone.value, normalise_phone(phone.value)) for phone in record.phones])
+        connection.executemany("INSERT INTO emails VALUES (?, ?, ?)",
+                               [(record_id, email.value, email.value.casefold()) for email in record.emails])
+        connection.executemany("INSERT INTO addresses VALUES (?, ?)",
+                               [(record_id, address.value) for address in record.addresses])
+        for note, tags in record.notes.items():
+            note_id = connection.execute("INSERT INTO notes (record_id, note) VALUES (?, ?)",
+                                         (record_id, note)).lastrowid
+            connection.executemany("INSERT INTO tags VALUES (?, ?, ?)",
+                                   [(note_id, tag, tag.casefold()) for tag in tags])
+
+    def _build_records(self, rows):
+        # rows are (id, name, birthday); the phones, emails, addresses and notes of a chunk of
+        # records are read with one query per table
+        records = []
+        for start in range(0, len(rows), CHUNK):
+            chunk = rows[start:start + CHUNK]
+            ids = [row[0] for row in chunk]
+            marks = ', '.join('?' * len(ids))
+            children = defaultdict(lambda: ([], [], [], {}))
+            for record_id, phone in self._query(
+                    f"SELECT record_id, phone FROM phones WHERE record_id IN ({marks}) ORDER BY rowid", ids):
+                children[record_id][0].append(make_field(Phone, phone))
+            for record_id, email in self._query(
+                    f"SELECT record_id, email FROM emails WHERE record_id IN ({marks}) ORDER BY rowid", ids):
+                children[record_id][1].append(make_field(Email, email))
+            for record_id, address in self._query(
+                    f"SELECT record_id, address FROM addresses WHERE record_id IN ({marks}) ORDER BY rowid", ids):
+                children[record_id][2].append(make_field(Address, address))
+            notes = {}
+            for note_id, record_id, note in self._query(
+                    f"SELECT id, record_id, note FROM notes WHERE record_id IN ({marks}) ORDER BY id", ids):
+                notes[note_id] = (record_id, note)
+                children[record_id][3][note] = []
+            for note_id, tag in self._query(
+                    f"SELECT tags.note_id, tags.tag FROM tags JOIN notes ON notes.id = tags.note_id "
+                    f"WHERE notes.record_id IN ({marks}) ORDER BY tags.rowid", ids):
+                record_id, note = notes[note_id]
+                children[record_id][3][note].append(tag)
+            for record_id, name, ordinal in chunk:
+                phones, emails, addresses, record_notes = children[record_id]
+                birthday = None
+                if ordinal is not None:
+                    birthday = Birthday.__new__(Birthday)
+                    birthday._ordinal = ordinal
+                record = Record.__new__(Record)
+                # __setstate__ interns the tags and leaves _book empty, as for a record read from a pickle
+                record.__setstate__((make_field(Name, name), phones, emails, addresses, record_notes, birthday))
+                record._book = self
+                records.append(record)
+        return records
+
+    def _records_where(self, condition, parameters=(), order='id', limit=None, offset=0):
+        sql = f"SELECT id, name, birthday FROM records WHERE {condition} ORDER BY {order}"
+        if limit is not None or offset:
+            sql += " LIMIT ? OFFSET ?"
+            parameters = (*parameters, -1 if limit is None else limit, offset)
+        return self._build_records(self._query(sql, parameters))
+
+    def __len__(self):
+        return self._query("SELECT count(*) FROM records")[0][0]
+
+    def __contains__(self, name):
+        return bool(self._query("SELECT 1 FROM records WHERE name = ?", (name,)))
+
+    def add_record(self, record):
+        with self._transaction() as connection:
+            self._write_record(connection, record)
+        record._book = self
+
+    def add_records(self, records):
+        # One transaction per batch; a commit per contact would cost one fsync each
+        added = 0
+        for start in range(0, len(records), self.batch_size):
+            batch = records[start:start + self.batch_size]
+            with self._transaction() as connection:
+                for record in batch:
+                    self._write_record(connection, record)
+            for record in batch:
+                record._book = self
+            added += len(batch)
+        return added
+
+    def find(self, name):
+        records = self._records_where("name = ?", (name,))
+        return records[0] if records else None
+
+    def iter_findname(self, name, offset=0, limit=None):
+        query = name.casefold()
+        if self._full_text and len(query) >= 3:
+            condition = ("id IN (SELECT rowid FROM name_grams WHERE name_grams MATCH ?) "
+                         "AND instr(folded, ?) > 0")
+            parameters = ('"' + query.replace('"', '""') + '"', query)
+        else:
+            condition, parameters = "instr(folded, ?) > 0", (query,)
+        yield from self._records_where(condition, parameters, limit=limit, offset=offset)
+
+    def findname(self, name):
+        found_contacts = list(self.iter_findname(name))
+        return found_contacts if found_contacts else None
+
+    def iter_records(self):
+        last_id = 0
+        while True:
+            rows = self._query("SELECT id, name, birthday FROM records WHERE id > ? ORDER BY id LIMIT ?",
+                               (last_id, CHUNK))
+            if not rows:
+                return
+            yield from self._build_records(rows)
+            last_id = rows[-1][0]
+
+    def iter_sorted_records(self, offset=0, limit=None, after=None):
+        if after is None:
+            condition, parameters = "1", ()
+        else:
+            condition, parameters = "(folded, name) > (?, ?)", (after.casefold(), after)
+        yield from self._records_where(condition, parameters, order='folded, name', limit=limit, offset=offset)
+
+    def render(self, record):
+        return str(record)
+
+    def remove_contact(self, name):
+        with self._transaction() as connection:
+            deleted = connection.execute("DELETE FROM records WHERE name = ?", (name,)).rowcount
+        if deleted:
+            print(f"Contact {name} deleted.")
+        else:
+            print("Contact not found.")
+
+    def find_notes_by_tag(self, tag):
+        return [tuple(row) for row in self._query(
+            "SELECT records.name, notes.note FROM tags JOIN notes ON notes.id = tags.note_id "
+            "JOIN records ON records.id = notes.record_id WHERE tags.folded = ? "
+            "GROUP BY notes.id ORDER BY records.id, notes.id", (tag.casefold(),))]
+
+    def find_contacts_by_tag(self, tag):
+        return [name for name, in self._query(
+            "SELECT records.name FROM tags JOIN notes ON notes.id = tags.note_id "
+            "JOIN records ON records.id = notes.record_id WHERE tags.folded = ? "
+            "GROUP BY records.id ORDER BY records.id", (tag.casefold(),))]
+
+    def find_notes(self, query, limit=None):
+        # Same query syntax as AddressBook.find_notes, ranked by SQLite's bm25 instead of our own score
+        terms = []
+        for term in query.split():
+            prefix = '*' if term.endswith('*') else ''
+            terms.extend(f'"{word}"{prefix}' for word in tokenize(term))
+        if not terms:
+            return []
+        if not self._full_text:
+            rows = self._query("SELECT records.name, notes.note, 1.0 FROM notes "
+                               "JOIN records ON records.id = notes.record_id ORDER BY notes.id")
+            words = [term.strip('"*') for term in terms]
+            rows = [row for row in rows if all(word in row[1].casefold() for word in words)]
+            return [tuple(row) for row in rows[:limit]]
+        sql = ("SELECT records.name, notes.note, -bm25(note_words) AS score FROM note_words "
+               "JOIN notes ON notes.id = note_words.rowid JOIN records ON records.id = notes.record_id "
+               "WHERE note_words MATCH ? ORDER BY score DESC, records.name, notes.note LIMIT ?")
+        return [tuple(row) for row in self._query(sql, (' '.join(terms), -1 if limit is None else limit))]
+
+    def who_has_phone(self, phone):
+        return [name for name, in self._query(
+            "SELECT DISTINCT records.name FROM phones JOIN records ON records.id = phones.record_id "
+            "WHERE phones.digits = ? ORDER BY records.id", (Record._phone_key(phone),))]
+
+    def who_has_email(self, email):
+        return [name for name, in self._query(
+            "SELECT DISTINCT records.name FROM emails JOIN records ON records.id = emails.record_id "
+            "WHERE emails.folded = ? ORDER BY records.id", (Record._email_key(email),))]
+
+    def _shared_values(self, table, column):
+        index = defaultdict(dict)
+        for value, name in self._query(
+                f"SELECT {table}.{column}, records.name FROM {table} JOIN records ON records.id = {table}.record_id "
+                f"WHERE {table}.{column} IN (SELECT {column} FROM {table} GROUP BY {column} "
+                f"HAVING count(DISTINCT record_id) > 1) ORDER BY {table}.{column}, records.id"):
+            index[value][name] = None
+        return index
+
+    def duplicate_contacts(self):
+        return group_shared_values((self._shared_values('phones', 'digits'), self._shared_values('emails', 'folded')))
+
+    def upcoming_birthdays(self, days=7, today=None):
+        # Same calendar walk as AddressBook.upcoming_birthdays, the days are looked up in the birthday index
+        today = today or date.today()
+        days_by_key = {}  # birthday_key -> (offset, day), every key comes up once within the horizon
+        for offset, day, keys in birthday_calendar(today, days):
+            for month, month_day in keys:
+                days_by_key[month * 100 + month_day] = (offset, day)
+        if not days_by_key:
+            return []
+        marks = ', '.join('?' * len(days_by_key))
+        rows = self._query(f"SELECT name, birthday, birthday_key FROM records WHERE birthday_key IN ({marks}) "
+                           f"ORDER BY id", list(days_by_key))
+        upcoming = []
+        for name, ordinal, key in rows:
+            birthday = date.fromordinal(ordinal)
+            offset, day = days_by_key[key]
+            upcoming.append(UpcomingBirthday(name, birthday, day, offset, day.year - birthday.year))
+        upcoming.sort(key=lambda hit: (hit.days, hit.birthday.day))  # on 28 February the 28th comes first
+        return upcoming
+
+    def iter_birthdays(self):
+        yield from self._query("SELECT name, birthday FROM records WHERE birthday IS NOT NULL ORDER BY id")
+
+    # These only go through find(), upcoming_birthdays() and iter_records(), so AddressBook's versions work here
+    remove_birthday = AddressBook.remove_birthday
+    get_birthdays_per_week = AddressBook.get_birthdays_per_week
+    when_birthdays = AddressBook.when_birthdays
+    export_contacts = AddressBook.export_contacts
+    import_contacts = AddressBook.import_contacts
+
+    def save_to_file(self, filename=None):
+        # Every change is committed as it happens, saving only folds the write-ahead log into the database
+        self.compact()
+
+    def compact(self):
+        if self._connection is not None:
+            self._query("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def close_journal(self):
+        if self._connection is not None:
+            self.compact()
+            self._connection.close()
+            self._connection = None
+
+
+def migrate_to_sqlite(source, target, batch_size=1000):
+    # Reads a snapshot, plain pickle or mapped file and copies its contacts into a SQLite database
+    if not os.path.exists(source):
+        raise FileNotFoundError(source)
+    book = read_address_book(source)
+    database = SQLiteAddressBook(target, batch_size)
+    batch = []
+    migrated = 0
+    for record in book.iter_records():
+        batch.append(record)
+        if len(batch) >= batch_size:
+            migrated += database.add_records(batch)
+            batch = []
+    migrated += database.add_records(batch)
+    database.close_journal()
+    print(f"Migrated {migrated} contacts from {source} to {target}")
+    return migrated
@@ -0,0 +1,16 @@
+import time
+
+from main import intelligent_analysis, suggest_command
+
+
+def test_mistyped_command_gets_a_suggestion():
+    assert intelligent_analysis("serach") == "search"
+    assert intelligent_analysis("zzzzzz") is None
+
+
+def test_long_token_is_not_expanded_or_cached():
+    cached = suggest_command.cache_info().currsize
+    started = time.perf_counter()
+    assert intelligent_analysis("x" * 5000) is None
+    assert time.perf_counter() - started < 0.5
+    assert suggest_command.cache_info().currsize == cached
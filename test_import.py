@@ -0,0 +1,20 @@
+from addressbook import validate_batch
+
+
+def test_note_tags_are_a_list_or_a_single_tag():
+    records, errors = validate_batch([
+        (1, {'name': "Ann Lee", 'notes': {"call back": "family"}}),
+        (2, {'name': "Bob Ray", 'notes': {"call back": ["family", "work"]}}),
+    ])
+    assert errors == []
+    assert [record.notes for record in records] == [{"call back": ("family",)}, {"call back": ("family", "work")}]
+
+
+def test_malformed_notes_reject_the_row():
+    records, errors = validate_batch([
+        (1, {'name': "Ann Lee", 'notes': ["call back"]}),
+        (2, {'name': "Bob Ray", 'notes': {"call back": [1, 2]}}),
+        (3, {'name': "Cid Moe", 'notes': {"call back": {"family": 1}}}),
+    ])
+    assert records == []
+    assert [line_number for line_number, _ in errors] == [1, 2, 3]
@@ -0,0 +1,20 @@
+import pytest
+
+from addressbook import AddressBook, Record
+from sqlite_backend import SQLiteAddressBook
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def book(request, tmp_path):
+    book = AddressBook() if request.param == 'memory' else SQLiteAddressBook(str(tmp_path / 'book.db'))
+    yield book
+    book.close_journal()
+
+
+def test_who_has_email_matches_the_canonical_address(book):
+    record = Record("Ann Lee")
+    record.add_email("ann@münchen.de")
+    book.add_record(record)
+    assert book.who_has_email("ann@xn--mnchen-3ya.de") == ["Ann Lee"]
+    assert book.who_has_email(" ANN@München.DE ") == ["Ann Lee"]
+    assert book.who_has_email("bob@münchen.de") == []
@@ -0,0 +1,137 @@
+import os
+import pickle
+import threading
+
+import pytest
+
+from addressbook import (AddressBook, Record, load_address_book_from_file, read_index_cache, write_snapshot,
+                         SNAPSHOT_HEADER)
+
+
+def contact(name, phone):
+    record = Record(name)
+    record.add_phone(phone)
+    return record
+
+
+def open_book(filename):
+    return load_address_book_from_file(filename, journal=True)
+
+
+def test_torn_journal_tail_is_cut_off(tmp_path):
+    filename = str(tmp_path / 'book.dat')
+    book = open_book(filename)
+    book.add_record(contact("Ann Lee", "0123456789"))
+    book.add_record(contact("Bob Ray", "0123456788"))
+    book.close_journal()
+    journal = filename + '.journal'
+    good_size = os.path.getsize(journal)
+    entry = pickle.dumps(('put', "Cid Moe", contact("Cid Moe", "0123456787")), protocol=pickle.HIGHEST_PROTOCOL)
+    with open(journal, 'ab') as file:
+        file.write(entry[:len(entry) // 2])  # the process died in the middle of a write
+
+    book = open_book(filename)
+    assert sorted(book.data) == ["Ann Lee", "Bob Ray"]
+    assert os.path.getsize(journal) == good_size
+    book.add_record(contact("Dan Fox", "0123456786"))
+    book.close_journal()
+
+    book = open_book(filename)
+    assert sorted(book.data) == ["Ann Lee", "Bob Ray", "Dan Fox"]
+    book.close_journal()
+
+
+@pytest.mark.parametrize('damage', ['flipped byte', 'truncated', 'empty'])
+def test_damaged_snapshot_falls_back_to_previous_generation(tmp_path, capsys, damage):
+    filename = str(tmp_path / 'book.dat')
+    book = open_book(filename)
+    book.add_record(contact("Ann Lee", "0123456789"))
+    book.compact()  # first generation, becomes book.dat.prev below
+    book.add_record(contact("Bob Ray", "0123456788"))
+    book.compact()  # Bob's entry moves to book.dat.journal.prev
+    book.add_record(contact("Cid Moe", "0123456787"))
+    book.close_journal()
+
+    with open(filename, 'r+b') as file:
+        if damage == 'flipped byte':
+            file.seek(SNAPSHOT_HEADER.size + 10)
+            byte = file.read(1)
+            file.seek(-1, os.SEEK_CUR)
+            file.write(bytes([byte[0] ^ 0xFF]))
+        else:
+            file.truncate(SNAPSHOT_HEADER.size // 2 if damage == 'truncated' else 0)
+
+    book = open_book(filename)
+    assert sorted(book.data) == ["Ann Lee", "Bob Ray", "Cid Moe"]
+    assert book.who_has_phone("0123456788") == ["Bob Ray"]
+    assert "previous generation" in capsys.readouterr().out
+    book.close_journal()
+
+
+def test_snapshot_keeps_the_state_it_was_started_with(tmp_path):
+    filename = str(tmp_path / 'book.dat')
+    book = AddressBook()
+    book.add_record(contact("Ann Lee", "0123456789"))
+    view = book._open_snapshot()
+    book.find("Ann Lee").add_phone("0123456788")  # changes while the snapshot is being written
+    book.add_record(contact("Bob Ray", "0123456787"))
+    write_snapshot(filename, view)
+    book._snapshot_views.remove(view)
+
+    saved = load_address_book_from_file(filename)
+    assert sorted(saved.data) == ["Ann Lee"]
+    assert [phone.value for phone in saved.find("Ann Lee").phones] == ["0123456789"]
+
+
+def test_stale_index_cache_is_rejected(tmp_path):
+    filename = str(tmp_path / 'book.dat')
+    book = open_book(filename)
+    book.add_record(contact("Ann Lee", "0123456789"))
+    book.compact()
+    assert read_index_cache(filename) is not None
+    with open(filename + '.index', 'rb') as file:
+        stale = file.read()
+    book.add_record(contact("Bob Ray", "0123456788"))
+    book.compact()
+    book.close_journal()
+
+    with open(filename + '.index', 'wb') as file:
+        file.write(stale)  # indexes of the previous snapshot
+    assert read_index_cache(filename) is None
+    book = load_address_book_from_file(filename)
+    assert book.who_has_phone("0123456788") == ["Bob Ray"]
+    assert [record.name.value for record in book.findname("Ray")] == ["Bob Ray"]
+
+    with open(filename + '.index', 'wb') as file:
+        file.write(stale[:20])  # torn write
+    book = load_address_book_from_file(filename)
+    assert sorted(book.data) == ["Ann Lee", "Bob Ray"]
+    assert book.who_has_phone("0123456789") == ["Ann Lee"]
+
+
+def test_snapshot_while_other_threads_change_the_book(tmp_path):
+    filename = str(tmp_path / 'book.dat')
+    book = AddressBook()
+    for number in range(200):
+        book.add_record(contact(f"Name {number}", f"0123456{number:03d}"))
+    stop = threading.Event()
+
+    def change():
+        number = 0
+        while not stop.is_set():
+            book.add_record(contact("Extra", "0123456789"))
+            del book["Extra"]
+            book.add_record(contact(f"Name {number % 200}", "0123456789"))
+            book.find(f"Name {(number + 1) % 200}").add_phone("0123456788")
+            number += 1
+
+    writer = threading.Thread(target=change)
+    writer.start()
+    try:
+        for _ in range(20):
+            book.save_to_file(filename)
+            saved = load_address_book_from_file(filename)
+            assert set(saved.data) - {"Extra"} == {f"Name {number}" for number in range(200)}
+    finally:
+        stop.set()
+        writer.join()